@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
+from decimal import Decimal
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,7 +40,6 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     'django_filters',
-    'debug_toolbar',
     'rest_framework',
     'djoser',
 
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,9 +56,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# the toolbar is a development tool only, production visibility comes from STORE_METRICS
+if DEBUG:
+    INSTALLED_APPS += ['debug_toolbar']
+    MIDDLEWARE += ["debug_toolbar.middleware.DebugToolbarMiddleware"]
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
@@ -94,6 +100,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# the cache versions of store.caching and core are shared by every worker through it,
+# a per-process backend (the default LocMemCache) leaves the other workers stale.
+# REDIS_URL locates the server of each environment, a local one by default
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -138,7 +158,7 @@ REST_FRAMEWORK = {
     # 'PAGE_SIZE': 5,
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
@@ -159,3 +179,42 @@ DJOSER = {
 }
 
 AUTH_USER_MODEL = 'core.CustomUser'
+
+# applied on top of the discounted price, see store.pricing
+STORE_TAX_RATE = Decimal('0.09')
+
+# anonymous carts older than this are expired, `manage.py purge_carts` deletes them
+STORE_CART_TTL = timedelta(days=30)
+
+# stock levels and the /store/stock-alerts/ stream, see store.stock
+STORE_STOCK = {
+    # inventory below LOW is Low, from HIGH on High, Medium in between
+    'LOW': 3,
+    'HIGH': 17,
+    # seconds a stream stays open, the client reconnects from its Last-Event-ID
+    'STREAM_TIMEOUT': 30,
+    # seconds between checks for new alerts, a primary key range read
+    'POLL_INTERVAL': 1,
+}
+
+# `manage.py dispatch_outbox`, see store.outbox
+STORE_OUTBOX = {
+    # 'thread' or 'process'
+    'POOL': 'thread',
+    'WORKERS': 4,
+    'BATCH_SIZE': 100,
+    # seconds a claimed event is reserved to its worker
+    'LEASE': 60,
+    'MAX_ATTEMPTS': 10,
+    # seconds, doubled after each failed attempt
+    'RETRY_DELAY': 5,
+    'MAX_RETRY_DELAY': 3600,
+}
+
+STORE_METRICS = {
+    'ENABLED': True,
+    # slowest SQL statements kept per route
+    'WORST_QUERIES': 5,
+    # /store/metrics/ is for staff users, and for a scraper sending "Authorization: Bearer <token>" when set
+    'TOKEN': None,
+}
@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import authentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from store.caching import is_shared
+from store.models import Customer
+
+USER_VERSION_KEY = 'core:user-version:{}'
+USER_KEY = 'core:jwt-user:{}:{}'
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    """
+    simplejwt's JWTAuthentication plus `aauthenticate`, used by the async read
+    views of store.async_views to look the user up with the async ORM.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        try:
+            user = await self.user_model.objects.aget(
+                **{api_settings.USER_ID_FIELD: self.get_user_id(validated_token)})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+        self.check_user(user, validated_token)
+        return user
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+    def check_user(self, user, validated_token, password_digest=None):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if password_digest is None:
+                password_digest = get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+
+def get_user_version(user_id):
+    key = USER_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        # from the clock like store.caching, an evicted counter must never reuse an old version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_user_version(user_id):
+    key = USER_VERSION_KEY.format(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_user_version(user_id):
+    """Drop the cached user and customer of `user_id`, once the current transaction commits."""
+    key = USER_VERSION_KEY.format(user_id)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+def bump_user_versions(user_ids):
+    """bump_user_version for many users with one cache call, for bulk updates bypassing the signals."""
+    # a deleted counter is re-seeded from the clock, that is a new version
+    keys = [USER_VERSION_KEY.format(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class UserLRU:
+    """Bounded, thread safe, least recently used map of the entries read from the cache."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the user and its Customer from an in-process LRU,
+    then the Django cache, then the database, so `request.user` and
+    `request.user.customer` cost no query on a warm cache.
+
+    Entries are keyed by user id and the user's version, which the signal
+    handlers in core.signals bump whenever the user or the customer is saved
+    or deleted (deactivation and password changes are saves). Bulk updates
+    bypass those signals, store.admin_bulk's bulk_changed bumps the versions.
+    Every request gets fresh instances, only field values are cached.
+
+    The password hash is never cached, the user is built with it deferred; with
+    CHECK_REVOKE_TOKEN the entry holds the digest tokens are checked against.
+    The versions have to be seen by every worker: with a per-process default
+    cache (store.caching.is_shared) users are read from the database.
+    """
+    cache_timeout = 60 * 5
+    # shared by the requests of the process, a subclass may bring its own
+    lru = UserLRU(1024)
+    uncached_fields = ('password',)
+
+    def get_user(self, validated_token):
+        if not is_shared():
+            return super().get_user(validated_token)
+        user_id = self.get_user_id(validated_token)
+        key = USER_KEY.format(user_id, get_user_version(user_id))
+
+        entry = self.get_entry(key)
+        if entry is None:
+            user = super().get_user(validated_token)
+            entry = self.set_entry(key, user, Customer.objects.filter(user=user).first())
+        return self.build_user(entry, validated_token)
+
+    async def aget_user(self, validated_token):
+        if not is_shared():
+            return await super().aget_user(validated_token)
+        user_id = self.get_user_id(validated_token)
+        key = USER_KEY.format(user_id, await aget_user_version(user_id))
+
+        entry = await self.aget_entry(key)
+        if entry is None:
+            user = await super().aget_user(validated_token)
+            entry = await self.aset_entry(key, user, await Customer.objects.filter(user=user).afirst())
+        return self.build_user(entry, validated_token)
+
+    def get_entry(self, key):
+        entry = self.lru.get(key)
+        if entry is None:
+            entry = cache.get(key)
+            if entry is not None:
+                self.lru.set(key, entry)
+        return entry
+
+    async def aget_entry(self, key):
+        entry = self.lru.get(key)
+        if entry is None:
+            entry = await cache.aget(key)
+            if entry is not None:
+                self.lru.set(key, entry)
+        return entry
+
+    def set_entry(self, key, user, customer):
+        entry = self.make_entry(user, customer)
+        cache.set(key, entry, self.cache_timeout)
+        self.lru.set(key, entry)
+        return entry
+
+    async def aset_entry(self, key, user, customer):
+        entry = self.make_entry(user, customer)
+        await cache.aset(key, entry, self.cache_timeout)
+        self.lru.set(key, entry)
+        return entry
+
+    def make_entry(self, user, customer):
+        password_digest = get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None
+        return self.values(user), self.values(customer) if customer is not None else None, password_digest
+
+    def build_user(self, entry, validated_token):
+        user_values, customer_values, password_digest = entry
+        user = self.user_model.from_db(DEFAULT_DB_ALIAS, self.field_names(self.user_model), user_values)
+        if customer_values is not None:
+            user.customer = Customer.from_db(DEFAULT_DB_ALIAS, self.field_names(Customer), customer_values)
+        self.check_user(user, validated_token, password_digest)
+        return user
+
+    def values(self, instance):
+        return tuple(getattr(instance, name) for name in self.field_names(type(instance)))
+
+    def field_names(self, model):
+        return [field.attname for field in model._meta.concrete_fields if field.attname not in self.uncached_fields]
@@ -0,0 +1,134 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from store.caching import is_shared
+
+from .authentication import UserLRU, aget_user_version, get_user_version
+
+PERMISSIONS_VERSION_KEY = 'core:permissions-version'
+USER_PERMISSIONS_KEY = 'core:user-permissions:{}:{}:{}'
+
+CACHE_TIMEOUT = 60 * 5
+
+# shared by the requests of the process
+lru = UserLRU(1024)
+
+
+def get_permissions_version():
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        # from the clock like store.caching, an evicted counter must never reuse an old version
+        cache.add(PERMISSIONS_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(PERMISSIONS_VERSION_KEY)
+    return version
+
+
+async def aget_permissions_version():
+    version = await cache.aget(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        await cache.aadd(PERMISSIONS_VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(PERMISSIONS_VERSION_KEY)
+    return version
+
+
+def bump_permissions_version():
+    """
+    Drop every cached permission set once the current transaction commits.
+    A group or permission change reaches any number of users, and they are rare.
+    """
+    def bump():
+        try:
+            cache.incr(PERMISSIONS_VERSION_KEY)
+        except ValueError:
+            cache.add(PERMISSIONS_VERSION_KEY, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+def permissions_key(user):
+    # the user version follows saves of the user, is_active and is_superuser included
+    return USER_PERMISSIONS_KEY.format(user.pk, get_user_version(user.pk), get_permissions_version())
+
+
+async def apermissions_key(user):
+    return USER_PERMISSIONS_KEY.format(user.pk, await aget_user_version(user.pk), await aget_permissions_version())
+
+
+def get_cached_permissions(key):
+    permissions = lru.get(key)
+    if permissions is None:
+        permissions = cache.get(key)
+        if permissions is not None:
+            lru.set(key, permissions)
+    return permissions
+
+
+async def aget_cached_permissions(key):
+    permissions = lru.get(key)
+    if permissions is None:
+        permissions = await cache.aget(key)
+        if permissions is not None:
+            lru.set(key, permissions)
+    return permissions
+
+
+def set_cached_permissions(key, permissions):
+    permissions = frozenset(permissions)
+    cache.set(key, permissions, CACHE_TIMEOUT)
+    lru.set(key, permissions)
+    return permissions
+
+
+async def aset_cached_permissions(key, permissions):
+    permissions = frozenset(permissions)
+    await cache.aset(key, permissions, CACHE_TIMEOUT)
+    lru.set(key, permissions)
+    return permissions
+
+
+def get_user_permissions(user):
+    """
+    The user and group permissions of `user`, resolved by the auth backends once
+    per version. Resolved on every call when the default cache is per process,
+    the other workers would never see a bumped version.
+    """
+    if not is_shared():
+        return user.get_all_permissions()
+    key = permissions_key(user)
+    permissions = get_cached_permissions(key)
+    if permissions is None:
+        permissions = set_cached_permissions(key, user.get_all_permissions())
+    return permissions
+
+
+async def aget_user_permissions(user):
+    if not is_shared():
+        return await user.aget_all_permissions()
+    key = await apermissions_key(user)
+    permissions = await aget_cached_permissions(key)
+    if permissions is None:
+        permissions = await aset_cached_permissions(key, await user.aget_all_permissions())
+    return permissions
+
+
+def has_perms(user, perms):
+    """
+    User.has_perms from the cached permission set. Same answer as
+    django.contrib.auth.backends.ModelBackend: active superusers have every
+    permission, inactive and anonymous users none.
+    """
+    if not user or not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perms) <= get_user_permissions(user)
+
+
+async def ahas_perms(user, perms):
+    if not user or not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    return set(perms) <= await aget_user_permissions(user)
@@ -1,7 +1,50 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
-from store.signals import order_created
 
+from store.admin_bulk import batches
+from store.models import Customer
+from store.signals import bulk_changed, order_created
 
+from .authentication import bump_user_version, bump_user_versions
+from .permissions import bump_permissions_version
+
+
+# delivered by the outbox worker, at least once
 @receiver(order_created)
 def after_order_created(sender, **kwargs):
     print(f"new order is created {kwargs['order'].id}")
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_cached_customer(sender, instance, **kwargs):
+    bump_user_version(instance.user_id)
+
+
+@receiver(bulk_changed, sender=get_user_model())
+def invalidate_cached_users(sender, pks, **kwargs):
+    bump_user_versions(pks)
+
+
+@receiver(bulk_changed, sender=Customer)
+def invalidate_cached_customers(sender, pks, **kwargs):
+    for batch in batches(pks):
+        bump_user_versions(Customer.objects.filter(pk__in=batch).values_list('user_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=Permission)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_cached_permissions(sender, action=None, **kwargs):
+    # the m2m changes are seen once, after the rows are written
+    if action is None or action.startswith('post_'):
+        bump_permissions_version()
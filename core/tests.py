@@ -1,3 +1,134 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from store.models import Customer
+
+from . import permissions
+from .authentication import USER_KEY, CachedJWTAuthentication, get_user_version
+from .models import CustomUser
+
+# store.caching.is_shared() accepts it, unlike LocMemCache, and it needs no server
+SHARED_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'api_drf_test_cache'),
+}}
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class CachedUserTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        CachedJWTAuthentication.lru.clear()
+        permissions.lru.clear()
+        self.user = CustomUser.objects.create_user('customer', 'customer@example.com', 'pw')
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def grant(self, codename):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.add(Permission.objects.get(codename=codename))
+
+
+class CachedJWTAuthenticationTests(CachedUserTestCase):
+    def test_warm_cache_costs_no_query(self):
+        self.client.get('/store/customers/me/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/store/customers/me/')
+        self.assertEqual(response.json()['id'], Customer.objects.get(user=self.user).pk)
+
+    def test_password_hash_not_cached(self):
+        self.client.get('/store/customers/me/')
+        entry = cache.get(USER_KEY.format(self.user.pk, get_user_version(self.user.pk)))
+        self.assertIsNotNone(entry)
+        self.assertNotIn(self.user.password, entry[0])
+
+    def test_saves_drop_the_cached_user(self):
+        self.client.get('/store/customers/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/store/customers/me/').status_code, 401)
+
+    def test_customer_saves_drop_the_cached_customer(self):
+        self.client.get('/store/customers/me/')
+        customer = Customer.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.birth_date = '2000-01-02'
+            customer.save()
+        self.assertEqual(self.client.get('/store/customers/me/').json()['birth_date'], '2000-01-02')
+
+    def test_async_lookup_uses_the_async_cache_api(self):
+        token = AccessToken.for_user(self.user)
+        with mock.patch.object(cache, 'aget', wraps=cache.aget) as aget, \
+                mock.patch.object(cache, 'aset', wraps=cache.aset) as aset:
+            user = async_to_sync(CachedJWTAuthentication().aget_user)(token)
+        self.assertEqual(user.customer, Customer.objects.get(user=self.user))
+        self.assertTrue(aget.called)
+        self.assertTrue(aset.called)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_per_process_cache_reads_the_database(self):
+        self.client.get('/store/customers/me/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/store/customers/me/').status_code, 200)
+        self.assertTrue(queries)
+
+
+class PermissionCacheTests(CachedUserTestCase):
+    def test_permissions_follow_grants(self):
+        self.assertEqual(self.client.get('/store/products/').status_code, 403)
+        self.grant('view_product')
+        self.assertEqual(self.client.get('/store/products/').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.clear()
+        self.assertEqual(self.client.get('/store/products/').status_code, 403)
+
+    def test_group_permissions(self):
+        group = Group.objects.create(name='support')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        customer = Customer.objects.get(user=self.user)
+        url = f'/store/customers/{customer.pk}/send_private_email/'
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(Permission.objects.get(codename='send_private_email'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_warm_cache_costs_no_query(self):
+        self.grant('view_product')
+        self.client.get('/store/products/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/store/products/').status_code, 200)
+
+    def test_async_lookup_uses_the_async_cache_api(self):
+        self.grant('view_product')
+        with mock.patch.object(cache, 'aget', wraps=cache.aget) as aget, \
+                mock.patch.object(cache, 'aset', wraps=cache.aset) as aset:
+            self.assertTrue(async_to_sync(permissions.ahas_perms)(self.user, ['store.view_product']))
+        self.assertTrue(aget.called)
+        self.assertTrue(aset.called)
+
+    def test_inactive_users_have_no_permission(self):
+        self.user.is_active = False
+        self.assertFalse(permissions.has_perms(self.user, ['store.view_product']))
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_per_process_cache_resolves_every_time(self):
+        self.grant('view_product')
+        self.assertEqual(permissions.get_user_permissions(self.user), {'store.view_product'})
+        # the version is bumped on a commit that never comes, only an uncached lookup sees this
+        Permission.objects.get(codename='view_product').user_set.remove(self.user)
+        user = CustomUser.objects.get(pk=self.user.pk)
+        self.assertEqual(permissions.get_user_permissions(user), set())
@@ -1,38 +1,38 @@
 from django.contrib import admin, messages
-from django.db.models import Count
+from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Lower, Upper
 from django.db.models.query import QuerySet
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.http import urlencode
 
-from . import models
+from . import models, outbox, stock
+from .admin_bulk import BulkEditMixin, update_in_batches
 from .models import CartItem
+from .paginations import EstimatedCountPaginator
 
 
-class InventoryFilter(admin.SimpleListFilter):
-    LESS_THAN_3 = '<3'
-    BETWEEN_3_15 = '3<=15'
-    MORE_THAN_16 = '>17'
+class EstimatedCountMixin:
+    """
+    Changelist of a large table: estimated row counts above a threshold and
+    no second COUNT(*) of the unfiltered table next to the filtered one.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
+class InventoryFilter(admin.SimpleListFilter):
     title = 'Critical Inventory Status'
     parameter_name = 'inventory'
 
     def lookups(self, request, model_admin):
-        return [
-            (InventoryFilter.LESS_THAN_3, 'Low'),
-            (InventoryFilter.BETWEEN_3_15, 'Medium'),
-            (InventoryFilter.MORE_THAN_16, 'High'),
-        ]
+        return models.StockAlert.LEVELS
 
     def queryset(self, request, queryset):
-        if self.value() == InventoryFilter.LESS_THAN_3:
-            return queryset.filter(inventory__lt=3)
-
-        if self.value() == InventoryFilter.BETWEEN_3_15:
-            return queryset.filter(inventory__range=(3, 15))
-
-        if self.value() == InventoryFilter.MORE_THAN_16:
-            return queryset.filter(inventory__gte=17)
+        if self.value() in dict(models.StockAlert.LEVELS):
+            # a range on the (inventory, id) index
+            return queryset.filter(stock.level_filter(self.value()))
 
 
 class ProductAdminInline(admin.TabularInline):
@@ -41,7 +41,7 @@ class ProductAdminInline(admin.TabularInline):
 
 
 @admin.register(models.Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(EstimatedCountMixin, BulkEditMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'inventory',
                     'unit_price', 'total', 'inventory_status', 'product_category', 'num_of_comments']
     list_per_page = 2
@@ -61,10 +61,7 @@ class ProductAdmin(admin.ModelAdmin):
     # exclude = ['discounts',]
     # readonly_fields = ['category',]
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('comments').annotate(num_of_comments=Count('comments'))
-
-    @admin.display(ordering='num_of_comments', description='# Comments')
+    @admin.display(ordering='approved_comments_count', description='# Comments')
     def num_of_comments(self, product: models.Product):
         # return product.num_of_comments
 
@@ -74,23 +71,20 @@ class ProductAdmin(admin.ModelAdmin):
                 + '?'
                 + urlencode(
             {
-                'product__id': product.id
+                'product__id': product.id,
+                'status__exact': models.Comment.COMMENT_STATUS_APPROVED,
             }
         )
         )
 
-        return format_html('<a href="{}">{}</a>', url, product.num_of_comments)
+        return format_html('<a href="{}">{}</a>', url, product.approved_comments_count)
 
     def total(self, product):
         return product.inventory * product.unit_price
 
+    @admin.display(ordering='inventory')
     def inventory_status(self, product: models.Product):
-        if product.inventory < 10:
-            return 'Low'
-        if product.inventory > 20:
-            return 'High'
-
-        return 'Medium'
+        return dict(models.StockAlert.LEVELS)[stock.stock_level(product.inventory)]
 
     # ordering category_name
     @admin.display(ordering='category__title')
@@ -99,7 +93,14 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description='Clear Inventory')
     def clear_inventory(self, request, queryset):
-        update_count = queryset.update(inventory=0)
+        def record_crossings(pks):
+            # locked until the batch commits, so the quantities read are the ones cleared
+            previous = (models.Product.objects.select_for_update().filter(pk__in=pks)
+                        .exclude(stock.level_filter(models.StockAlert.LEVEL_LOW))
+                        .order_by('pk').values_list('id', 'inventory'))
+            stock.record_crossings([(product_id, inventory, 0) for product_id, inventory in previous])
+
+        update_count = update_in_batches(queryset, before_update=record_crossings, inventory=0)
         self.message_user(
             request,
             f'{update_count} of product inventories cleared to zero.',
@@ -126,15 +127,17 @@ class CustomerAdmin(admin.ModelAdmin):
 
     @admin.action(description='Make Selected Upper first name')
     def uppercase(self, request, queryset):
-        for obj in queryset:
-            obj.user.first_name = obj.user.first_name.upper()
-            obj.save()
+        self.change_first_name(request, queryset, Upper)
 
     @admin.action(description='Make Selected Lower first name')
     def lowercase(self, request, queryset):
-        for obj in queryset:
-            obj.user.first_name = obj.user.first_name.lower()
-            obj.save()
+        self.change_first_name(request, queryset, Lower)
+
+    def change_first_name(self, request, queryset, function):
+        # the names live on the user, changed in the database without loading a row
+        users = get_user_model().objects.filter(customer__in=queryset)
+        update_count = update_in_batches(users, first_name=function('first_name'))
+        self.message_user(request, f'{update_count} first names changed.', messages.SUCCESS)
 
 
 class OrderItemInline(admin.TabularInline):  # StackedInline
@@ -146,18 +149,23 @@ class OrderItemInline(admin.TabularInline):  # StackedInline
 
 
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(EstimatedCountMixin, BulkEditMixin, admin.ModelAdmin):
     list_display = ['id', 'customer', 'status',
                     'datetime_created', 'num_of_items']
-    ordering = ['datetime_created', ]
+    # unique with the id, so the admin adds no '-pk' and the (datetime_created, id) index serves it
+    ordering = ['datetime_created', 'id']
     list_editable = ['status', ]
     list_per_page = 4
-    list_select_related = ['customer', ]
-    search_fields = ['customer__last_name', ]
+    # Customer.__str__ reads the user
+    list_select_related = ['customer__user', ]
+    search_fields = ['customer__user__last_name', ]
     inlines = [OrderItemInline]
 
     def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related('items').annotate(items_count=Count('items'))
+        # counted for the rows of the page only, a join and GROUP BY would aggregate the whole table
+        items_count = (models.OrderItem.objects.filter(order=OuterRef('pk'))
+                       .order_by().values('order').annotate(c=Count('id')).values('c'))
+        return super().get_queryset(request).annotate(items_count=Coalesce(Subquery(items_count), 0))
 
     @admin.display(ordering='items_count', description='# items')
     def num_of_items(self, order: models.Order):
@@ -171,12 +179,13 @@ class OrderItemAdmin(admin.ModelAdmin):
 
 
 @admin.register(models.Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(EstimatedCountMixin, BulkEditMixin, admin.ModelAdmin):
     list_display = ['id', 'product', 'status', 'product_name', 'body', 'name']
     list_editable = ['status']
     list_per_page = 3
     list_select_related = ['product', ]
     list_display_links = ['product', ]
+    list_filter = ['status']
     actions = ['make_wa']
     autocomplete_fields = ['product', ]
 
@@ -185,7 +194,7 @@ class CommentAdmin(admin.ModelAdmin):
 
     @admin.action(description='Mark Selected Status Waiting')
     def make_wa(self, request, queryset):
-        queryset.update(status='w')
+        update_in_batches(queryset, status=models.Comment.COMMENT_STATUS_WAITING)
 
 
 @admin.register(models.Category)
@@ -206,6 +215,29 @@ class CartItemInline(admin.TabularInline):
 
 
 @admin.register(models.Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['id', 'created_at']
     inlines = [CartItemInline]
+
+
+@admin.register(models.OutboxEvent)
+class OutboxEventAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ['id', 'topic', 'payload', 'attempts', 'created_at', 'available_at', 'dispatched_at', 'failed_at']
+    list_filter = ['topic', ('failed_at', admin.EmptyFieldListFilter)]
+    # written by store.outbox only
+    readonly_fields = ['topic', 'payload', 'created_at', 'attempts', 'last_error', 'dispatched_at', 'failed_at']
+    actions = ['retry']
+
+    @admin.action(description='Retry selected dead-lettered events')
+    def retry(self, request, queryset):
+        update_count = outbox.retry(queryset)
+        self.message_user(request, f'{update_count} events queued for delivery again.', messages.SUCCESS)
+
+
+@admin.register(models.StockAlert)
+class StockAlertAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ['id', 'product', 'previous_level', 'level', 'inventory', 'created_at']
+    list_filter = ['level']
+    list_select_related = ['product', ]
+    # written by store.stock only
+    readonly_fields = ['product', 'previous_level', 'level', 'inventory', 'created_at']
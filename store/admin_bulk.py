@@ -0,0 +1,98 @@
+"""
+Set-based changes for the admin: actions and list_editable saves update the
+selected rows with one UPDATE per batch instead of a save() per object.
+
+save() and its signals are bypassed, so `auto_now` fields are set here and a
+single `store.signals.bulk_changed` is sent once all batches are written. Its
+receivers refresh the derived data (cache versions, counters, search index)
+for the whole set at once.
+"""
+from itertools import islice
+
+from django.db import router, transaction
+from django.utils import timezone
+
+from .signals import bulk_changed
+
+BATCH_SIZE = 5000
+
+
+def batches(items, size=BATCH_SIZE):
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _auto_now_fields(model):
+    return [field.name for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+
+
+def update_in_batches(queryset, batch_size=BATCH_SIZE, before_update=None, **values):
+    """
+    queryset.update(**values) over the primary keys of `queryset`, one short
+    transaction per `batch_size` rows. `values` may hold expressions such as
+    F() or Upper(). `before_update` is called with the primary keys of each
+    batch in its transaction, before the UPDATE. Returns the number of rows updated.
+    """
+    model = queryset.model
+    values = {**{name: timezone.now() for name in _auto_now_fields(model)}, **values}
+    # fixed up front, the update may take rows out of the queryset's own filter
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+
+    updated = 0
+    for batch in batches(pks, batch_size):
+        with transaction.atomic(using=queryset.db):
+            if before_update is not None:
+                before_update(batch)
+            updated += model._base_manager.using(queryset.db).filter(pk__in=batch).update(**values)
+
+    if pks:
+        bulk_changed.send(sender=model, pks=pks, fields=frozenset(values))
+    return updated
+
+
+def save_in_batches(objs, fields, batch_size=BATCH_SIZE):
+    """bulk_update() of `fields` on the model instances `objs`, `batch_size` rows per statement."""
+    if not objs:
+        return 0
+    model = type(objs[0])
+    now = timezone.now()
+    fields = set(fields)
+    for name in _auto_now_fields(model):
+        fields.add(name)
+        for obj in objs:
+            setattr(obj, name, now)
+
+    updated = 0
+    for batch in batches(objs, batch_size):
+        with transaction.atomic(using=router.db_for_write(model)):
+            updated += model._base_manager.bulk_update(batch, fields)
+
+    bulk_changed.send(sender=model, pks=[obj.pk for obj in objs], fields=frozenset(fields))
+    return updated
+
+
+class BulkEditMixin:
+    """
+    ModelAdmin mixin saving the rows changed through `list_editable` with
+    save_in_batches, grouped by the set of fields changed, instead of one
+    save_model() per row.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if not (request.method == 'POST' and self.list_editable and '_save' in request.POST):
+            return super().changelist_view(request, extra_context)
+
+        # one transaction around the admin's own, so the rows are written with the change log
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            request._bulk_edits = {}
+            response = super().changelist_view(request, extra_context)
+            for fields, objs in request.__dict__.pop('_bulk_edits').items():
+                save_in_batches(objs, fields)
+        return response
+
+    def save_model(self, request, obj, form, change):
+        edits = getattr(request, '_bulk_edits', None)
+        if edits is None or not change:
+            return super().save_model(request, obj, form, change)
+        edits.setdefault(frozenset(form.changed_data), []).append(obj)
@@ -0,0 +1,107 @@
+"""
+Daily sales rollups for the staff reports.
+
+ProductSalesDay and CategorySalesDay hold the orders count, units and revenue
+of each day per product and per category, canceled orders left out. They are
+adjusted as orders are placed and canceled (store.signals.handlers) and
+recomputed from the order items by `manage.py rebuild_sales_rollups`, so a
+report reads one row per day and product or category, whatever the number of
+orders behind it.
+
+Days are the local dates (TIME_ZONE) of Order.datetime_created.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CategorySalesDay, Order, OrderItem, ProductSalesDay
+
+REVENUE_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def counts_as_sale(status):
+    return status != Order.ORDER_STATUS_CANCELED
+
+
+def record_order(order, sign=1):
+    """
+    Add the items of `order` to the rollups of its day, or take them out with
+    sign=-1. Returns the units per product, signed.
+    """
+    products, categories = {}, {}
+    for product_id, category_id, quantity, unit_price in (OrderItem.objects.filter(order=order)
+                                                          .values_list('product_id', 'product__category_id',
+                                                                       'quantity', 'unit_price')):
+        # one item per product and order
+        products[product_id] = (sign, sign * quantity, sign * quantity * unit_price)
+        _, units, revenue = categories.get(category_id, (sign, 0, 0))
+        categories[category_id] = (sign, units + sign * quantity, revenue + sign * quantity * unit_price)
+
+    day = timezone.localdate(order.datetime_created)
+    ProductSalesDay.objects.add(day, products)
+    CategorySalesDay.objects.add(day, categories)
+    return {product_id: units for product_id, (_, units, _) in products.items()}
+
+
+def day_bounds(start, end):
+    """The datetimes bounding the local days start..end, end included."""
+    return (timezone.make_aware(datetime.combine(start, time.min)),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+
+def rebuild_days(start, end, batch_size=1000):
+    """Recompute the rollups of the days start..end (included) from the order items."""
+    since, until = day_bounds(start, end)
+    items = (OrderItem.objects.filter(order__datetime_created__gte=since, order__datetime_created__lt=until)
+             .exclude(order__status=Order.ORDER_STATUS_CANCELED)
+             .annotate(day=TruncDate('order__datetime_created')).order_by())
+    totals = {
+        'orders_count': Count('order', distinct=True),
+        'units': Sum('quantity'),
+        'revenue': Sum(F('quantity') * F('unit_price'), output_field=REVENUE_FIELD),
+    }
+
+    with transaction.atomic():
+        ProductSalesDay.objects.filter(day__range=(start, end)).delete()
+        CategorySalesDay.objects.filter(day__range=(start, end)).delete()
+        products = ProductSalesDay.objects.bulk_create(
+            [ProductSalesDay(**row) for row in items.values('day', 'product_id').annotate(**totals)],
+            batch_size=batch_size)
+        categories = CategorySalesDay.objects.bulk_create(
+            [CategorySalesDay(**row) for row in
+             items.values('day', category_id=F('product__category_id')).annotate(**totals)],
+            batch_size=batch_size)
+    return len(products), len(categories)
+
+
+def sales_report(start, end, category_id=None, limit=10):
+    """
+    Sales of the days start..end (included) from the rollups: daily totals,
+    totals per category and the `limit` best products by revenue.
+    """
+    category_days = CategorySalesDay.objects.filter(day__range=(start, end))
+    product_days = ProductSalesDay.objects.filter(day__range=(start, end))
+    if category_id is not None:
+        category_days = category_days.filter(category_id=category_id)
+        product_days = product_days.filter(product__category_id=category_id)
+
+    sums = {'units': Sum('units'), 'revenue': Sum('revenue')}
+    days = list(category_days.values('day').annotate(**sums).order_by('day'))
+    categories = list(category_days.values('category_id')
+                      .annotate(orders_count=Sum('orders_count'), **sums).order_by('-revenue', 'category_id'))
+    products = list(product_days.values('product_id')
+                    .annotate(orders_count=Sum('orders_count'), **sums).order_by('-revenue', 'product_id')[:limit])
+
+    return {
+        'start': start,
+        'end': end,
+        'units': sum(row['units'] for row in days),
+        'revenue': sum((row['revenue'] for row in days), Decimal(0)),
+        'days': days,
+        'categories': categories,
+        'products': products,
+    }
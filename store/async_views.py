@@ -0,0 +1,123 @@
+"""
+Native async GET handlers for the hot read paths of the store viewsets.
+
+A viewset with AsyncReadMixin is routed as usual, but `as_view` returns a
+coroutine view: GET requests for the actions in `async_actions` run on the
+event loop through the `a<action>` handlers (alist, aretrieve) with the async
+ORM, everything else is handed to the regular sync view. Under WSGI Django
+runs the coroutine view through async_to_sync, so the URLs work on both.
+"""
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+
+
+class AsyncReadMixin:
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if not actions or actions.get('get') not in cls.async_actions:
+            return sync_view
+
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            self.format_kwarg = None
+
+            response = await self.adispatch(request, *args, **kwargs)
+            if response is None:
+                # not a JSON client, the browsable API renders forms with sync queries
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            return response
+
+        update_wrapper(view, sync_view)
+        return csrf_exempt(view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            renderer, media_type = self.perform_content_negotiation(request)
+        except exceptions.APIException:
+            return None
+        if not isinstance(renderer, JSONRenderer):
+            return None
+        request.accepted_renderer, request.accepted_media_type = renderer, media_type
+
+        try:
+            version, scheme = self.determine_version(request, *args, **kwargs)
+            request.version, request.versioning_scheme = version, scheme
+            await self.aperform_authentication(request)
+            await self.acheck_permissions(request)
+            self.check_throttles(request)
+
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        response = self.finalize_response(request, response, *args, **kwargs)
+        return self.detach_response(response)
+
+    async def aperform_authentication(self, request):
+        # rest_framework.request.Request._authenticate with the async lookups of the authenticators
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def acheck_permissions(self, request):
+        # permissions without ahas_permission must not touch the database
+        for permission in self.get_permissions():
+            if hasattr(permission, 'ahas_permission'):
+                allowed = await permission.ahas_permission(request, self)
+            else:
+                allowed = permission.has_permission(request, self)
+            if not allowed:
+                self.permission_denied(
+                    request,
+                    message=getattr(permission, 'message', None),
+                    code=getattr(permission, 'code', None),
+                )
+
+    def detach_response(self, response):
+        """
+        Render here and hand Django a plain HttpResponse, a template response
+        would be rendered again in a worker thread by the async handler.
+        """
+        if not hasattr(response, 'render'):
+            return response
+        response.render()
+        rendered = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
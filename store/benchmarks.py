@@ -0,0 +1,89 @@
+"""
+Helpers shared by the `bench_*` management commands.
+
+Benchmarks never touch the configured database: they run against a throwaway
+test database created the same way `manage.py test` does.
+"""
+import itertools
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from .models import Category, Product
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'gu', 'be', 'fi', 'ho', 'ja']
+# 4096 made-up words, a catalog vocabulary is much larger than a handful of adjectives
+WORDS = [''.join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    # as `manage.py test` does: the test client's 'testserver' host is allowed, emails go to the locmem outbox
+    setup_test_environment()
+    try:
+        old_config = setup_databases(verbosity, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(old_config, verbosity)
+    finally:
+        teardown_test_environment()
+
+
+def seed_catalog(products, categories=50, batch_size=5000, seed=0):
+    """
+    Bulk insert `categories` categories and `products` products with random names.
+    Words are drawn with a skewed distribution so some are common and most are rare.
+    Signals are bypassed, callers rebuild whatever derived data they need.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+    def words(count):
+        return ' '.join(rng.choices(WORDS, weights, k=count))
+
+    Category.objects.bulk_create(
+        [Category(title=f'{words(1)} {index}') for index in range(categories)])
+    category_ids = list(Category.objects.values_list('id', flat=True))
+
+    batch = []
+    for index in range(products):
+        batch.append(Product(
+            name=f'{words(3)} {index}',
+            slug=f'product-{index}',
+            description=words(12),
+            category_id=rng.choice(category_ids),
+            unit_price=rng.randint(100, 99999) / 100,
+            inventory=rng.randint(0, 50),
+        ))
+        if len(batch) >= batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    Product.objects.bulk_create(batch)
+    Category.objects.rebuild_product_counters()
+
+
+def measure(func, repeat, setup=None):
+    """Time `repeat` calls of `func`, passed the result of `setup()` when given, which is not timed."""
+    timings = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    """p50 / p95 / max in milliseconds."""
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {
+        'p50': round(statistics.median(ordered) * 1000, 3),
+        'p95': round(p95 * 1000, 3),
+        'max': round(ordered[-1] * 1000, 3),
+    }
@@ -0,0 +1,174 @@
+import codecs
+import csv
+import io
+import json
+
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import stock
+from .caching import bump_version
+from .models import Category, Product
+from .search import index_products
+from .serializers import ProductImportSerializer
+
+EXPORT_FIELDS = ['id', 'title', 'price', 'category', 'inventory', 'slug', 'description']
+# API field -> model column, matches ProductSerializer's source renames
+EXPORT_SOURCES = {'title': 'name', 'price': 'unit_price', 'category': 'category_id'}
+MAX_REPORTED_ERRORS = 100
+
+
+def _lines(stream):
+    return codecs.iterdecode(iter(stream.readline, b''), 'utf-8')
+
+
+def read_ndjson(stream):
+    for line_number, line in enumerate(_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def read_csv(stream):
+    reader = csv.DictReader(_lines(stream))
+    for row in reader:
+        yield reader.line_num, {key: value for key, value in row.items() if value != ''}
+
+
+def import_products(rows, batch_size=1000):
+    """
+    Validate and write `rows` ((line number, data) pairs) batch by batch.
+    Rows with an `id` update that product, the others are created. Invalid rows,
+    and rows repeating an id already updated in their batch, are reported and
+    skipped. Every valid batch is written in its own transaction.
+    """
+    summary = {'created': 0, 'updated': 0, 'errors': []}
+
+    batch = []
+    for line_number, data in rows:
+        batch.append((line_number, data))
+        if len(batch) >= batch_size:
+            _import_batch(batch, batch_size, summary)
+            batch = []
+    if batch:
+        _import_batch(batch, batch_size, summary)
+
+    if summary['created'] or summary['updated']:
+        bump_version(Product)
+    return summary
+
+
+def _import_batch(batch, batch_size, summary):
+    valid = []
+    for line_number, data in batch:
+        if data is None:
+            _report(summary, line_number, {'non_field_errors': ['Invalid row']})
+            continue
+        serializer = ProductImportSerializer(data=data)
+        if serializer.is_valid():
+            valid.append((line_number, serializer.validated_data))
+        else:
+            _report(summary, line_number, serializer.errors)
+
+    category_ids = {data['category_id'] for _, data in valid}
+    known_categories = set(Category.objects.filter(id__in=category_ids).values_list('id', flat=True))
+    update_ids = {data['id'] for _, data in valid if data.get('id') is not None}
+    previous = {product_id: (category_id, inventory) for product_id, category_id, inventory in
+                Product.objects.filter(id__in=update_ids).values_list('id', 'category_id', 'inventory')}
+    previous_categories = {product_id: category_id for product_id, (category_id, _) in previous.items()}
+
+    to_create, to_update = [], []
+    # product id -> line updating it, a batch writes each product once
+    update_lines = {}
+    now = timezone.now()
+    for line_number, data in valid:
+        if data['category_id'] not in known_categories:
+            _report(summary, line_number, {'category': ['Invalid pk - object does not exist.']})
+            continue
+        product_id = data.pop('id', None)
+        if product_id is not None and product_id not in previous_categories:
+            _report(summary, line_number, {'id': ['Invalid pk - object does not exist.']})
+            continue
+        if product_id is not None and product_id in update_lines:
+            _report(summary, line_number, {'id': [f'Duplicate pk - already updated by line {update_lines[product_id]}.']})
+            continue
+
+        product = Product(**data, slug=slugify(data['name']))
+        if product_id is None:
+            to_create.append(product)
+        else:
+            product.id = product_id
+            update_lines[product_id] = line_number
+            product.datetime_modified = now
+            to_update.append(product)
+
+    if not to_create and not to_update:
+        return
+
+    with transaction.atomic():
+        # backends that cannot return primary keys from bulk inserts find the new rows by id range
+        last_id = None
+        if to_create and not connection.features.can_return_rows_from_bulk_insert:
+            last_id = Product.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        Product.objects.bulk_create(to_create, batch_size=batch_size)
+        Product.objects.bulk_update(
+            to_update,
+            ['name', 'slug', 'category', 'description', 'unit_price', 'inventory', 'datetime_modified'],
+            batch_size=batch_size)
+
+        # bulk writes skip the signal handlers, refresh what they maintain
+        touched_categories = category_ids | set(previous_categories.values())
+        Category.objects.filter(id__in=touched_categories).rebuild_product_counters()
+        touched_products = Q(id__in=[product.pk for product in to_update + to_create if product.pk])
+        if last_id is not None:
+            touched_products |= Q(id__gt=last_id)
+        index_products(Product.objects.filter(touched_products), batch_size=batch_size)
+        stock.record_crossings([(product.pk, previous[product.pk][1], product.inventory) for product in to_update])
+
+    summary['created'] += len(to_create)
+    summary['updated'] += len(to_update)
+
+
+def _report(summary, line_number, errors):
+    if len(summary['errors']) < MAX_REPORTED_ERRORS:
+        summary['errors'].append({'line': line_number, 'errors': errors})
+
+
+def _export_rows(columns, chunk_size):
+    # keyset batches rather than .iterator(): MySQLdb fetches a whole result set
+    # into memory, each batch here is a short query on the primary key
+    products = Product.objects.order_by('id').values_list(*columns)
+    last_id = 0
+    while batch := list(products.filter(id__gt=last_id)[:chunk_size]):
+        yield from batch
+        # id is the first column
+        last_id = batch[-1][0]
+
+
+def export_products(output, chunk_size=2000):
+    """Yield the whole catalog as NDJSON or CSV lines, `chunk_size` rows per database fetch."""
+    columns = [EXPORT_SOURCES.get(field, field) for field in EXPORT_FIELDS]
+    rows = _export_rows(columns, chunk_size)
+
+    if output == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        encoder = JSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
@@ -0,0 +1,236 @@
+"""
+Version counters and the response caches built on them.
+
+The versions live in the default cache. It has to be shared by every worker
+(Redis or Memcached, see CACHES in config.settings): with a per-process
+backend a version bumped by one worker never reaches the others, which keep
+serving the old entries until they expire. `manage.py check` warns about a
+per-process default cache, see store.checks.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+VERSION_KEY = 'store:version:{}'
+RESPONSE_KEY = 'store:response:{}:{}:{}'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def response_cache_stats():
+    with _stats_lock:
+        return {'hits': _stats['hits'], 'misses': _stats['misses']}
+
+
+def is_shared(alias=DEFAULT_CACHE_ALIAS):
+    """Whether the entries of cache `alias` are seen by every worker process."""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def get_versions(models):
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # start from the clock rather than 1, an evicted counter must never reuse an old version
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(models):
+    keys = [_version_key(model) for model in models]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """
+    Invalidate every cached response depending on `model`.
+    Deferred until the current transaction commits so no reader can cache
+    pre-commit rows under the new version.
+    """
+    key = _version_key(model)
+
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    """
+    Read-through cache for the list and retrieve actions of a viewset.
+
+    Serialized data is cached under a key made of the request path, its query
+    params and the current versions of `cache_models`, so any save or delete of
+    those models makes the old entries unreachable. Permissions are still checked
+    on every request, only the queryset and serializer work is skipped.
+    """
+    cache_models = ()
+    cache_timeout = 60 * 5
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request, *args, **kwargs)
+
+    def get_response_cache_key(self, request):
+        return self.make_response_cache_key(request, get_versions(self.cache_models))
+
+    async def aget_response_cache_key(self, request):
+        return self.make_response_cache_key(request, await aget_versions(self.cache_models))
+
+    def make_response_cache_key(self, request, versions):
+        params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        # pagination links are absolute, so the host is part of the key
+        raw = f'{request.get_host()}{request.path}?{params}'
+        versions = '.'.join(str(version) for version in versions)
+        return RESPONSE_KEY.format(self.basename, versions, hashlib.md5(raw.encode()).hexdigest())
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+
+        data = cache.get(key)
+        if data is not None:
+            _record('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _record('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        # the async cache API, a backend without native async methods runs the sync
+        # ones in a worker thread rather than blocking the event loop on the network
+        key = await self.aget_response_cache_key(request)
+
+        data = await cache.aget(key)
+        if data is not None:
+            _record('hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _record('misses')
+        response = await handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            await cache.aset(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified support for list and retrieve, answered with 304 before
+    the object is loaded or serialized.
+
+    Detail pages use `modified_field` of the object, every write that changes the
+    representation has to touch it. List pages hash the versions of `cache_models`
+    (see CachedResponseMixin) with the query params, so their validators cost no
+    query: any save or delete of those models changes every list ETag.
+    """
+    modified_field = 'datetime_modified'
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            modified = self.get_modified_queryset().first()
+        except (TypeError, ValueError, ValidationError):
+            # malformed lookup value, retrieve answers with the 404
+            modified = None
+        if modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(request, *self.detail_validators(modified), super().retrieve, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, self.list_etag(request), None, super().list, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        try:
+            modified = await self.get_modified_queryset().afirst()
+        except (TypeError, ValueError, ValidationError):
+            modified = None
+        if modified is None:
+            return await super().aretrieve(request, *args, **kwargs)
+        return await self.aconditional_response(
+            request, *self.detail_validators(modified), super().aretrieve, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aconditional_response(
+            request, await self.alist_etag(request), None, super().alist, *args, **kwargs)
+
+    def get_modified_queryset(self):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_queryset().filter(**{self.lookup_field: lookup}).values_list(self.modified_field, flat=True)
+
+    def detail_validators(self, modified):
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        etag = f'W/"{lookup}-{int(modified.timestamp() * 1_000_000)}"'
+        return etag, int(modified.timestamp())
+
+    def list_etag(self, request):
+        return self.make_list_etag(request, get_versions(self.cache_models))
+
+    async def alist_etag(self, request):
+        return self.make_list_etag(request, await aget_versions(self.cache_models))
+
+    def make_list_etag(self, request, versions):
+        params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        versions = '.'.join(str(version) for version in versions)
+        # pagination links are absolute, so the host is part of the tag
+        raw = f'{versions}|{request.get_host()}{request.path}|{params}'
+        return f'W/"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+    def conditional_response(self, request, etag, last_modified, handler, *args, **kwargs):
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        return self.add_validators(handler(request, *args, **kwargs), etag, last_modified)
+
+    async def aconditional_response(self, request, etag, last_modified, handler, *args, **kwargs):
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        return self.add_validators(await handler(request, *args, **kwargs), etag, last_modified)
+
+    def add_validators(self, response, etag, last_modified):
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
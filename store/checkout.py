@@ -0,0 +1,76 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import outbox, pricing, stock
+from .caching import bump_version
+from .models import Cart, CartItem, Category, Order, OrderItem, Product
+from .signals import order_placed
+
+
+def place_order(cart_id, customer_id):
+    """
+    Turn the cart into an order for `customer_id` in one transaction.
+
+    Cart lines and their products are locked with a single SELECT ... FOR UPDATE,
+    ordered by product so concurrent checkouts always lock in the same order.
+    Inventory is checked and decremented under that lock, so two checkouts
+    competing for the last units can never both succeed. The sales counters
+    (order_placed) and the order_created outbox event are written in the same
+    transaction.
+    """
+    with transaction.atomic():
+        cart_items = list(
+            CartItem.objects.select_related('product').select_for_update()
+            .filter(cart_id=cart_id).order_by('product_id'))
+
+        if not cart_items:
+            raise serializers.ValidationError(
+                {'cart_id': 'Your cart is empty. Please add some product to it first'})
+
+        short = [item.product.name for item in cart_items if item.quantity > item.product.inventory]
+        if short:
+            raise serializers.ValidationError(
+                {'cart_id': f'Not enough inventory for: {", ".join(short)}'})
+
+        order = Order.objects.create(customer_id=customer_id)
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                # the discounted price of the locked row, what the cart totals showed
+                unit_price=pricing.discounted_price(item.product.unit_price, item.product.best_discount),
+                quantity=item.quantity,
+            ) for item in cart_items
+        ])
+
+        products = []
+        sold_out = Counter()
+        crossings = []
+        now = timezone.now()
+        for item in cart_items:
+            product = item.product
+            crossings.append((product.pk, product.inventory, product.inventory - item.quantity))
+            product.inventory -= item.quantity
+            product.datetime_modified = now
+            products.append(product)
+            if product.inventory <= 0 < product.inventory + item.quantity:
+                sold_out[product.category_id] -= 1
+        Product.objects.bulk_update(products, ['inventory', 'datetime_modified'])
+
+        # bulk_update skips the signal handlers keeping these in sync
+        Category.objects.adjust_in_stock_counters(sold_out)
+        stock.record_crossings(crossings)
+        bump_version(Product)
+
+        Cart.objects.filter(id=cart_id).delete()
+
+        # the data derived from orders commit with it, like the category counters above
+        order_placed.send(sender=Order, order=order)
+        # the side effects run from the outbox once this commits
+        outbox.publish('order_created', order)
+
+        return order
@@ -0,0 +1,16 @@
+from django.core.checks import Tags, Warning, register
+
+from .caching import is_shared
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if is_shared():
+        return []
+    return [Warning(
+        'The default cache is local to each process.',
+        hint='The cache versions of store.caching and the user and permission caches of core are '
+             'only invalidated in the worker making the change. Configure a Redis or Memcached '
+             'default cache when running more than one process.',
+        id='store.W001',
+    )]
@@ -0,0 +1,200 @@
+"""
+Read-only fast path for list/retrieve: a serializer class is compiled once into
+a field plan (output name -> column of a `.values()` row -> the field's own
+to_representation), so rows are rendered without model instances or the per
+field get_attribute machinery, and the JSON stays byte-identical.
+
+Serializers opt in to what cannot be derived from their fields:
+
+* `method_columns` -- {method field: [columns it reads]}, the method is called
+  with a row object giving attribute access to those columns.
+* `related_querysets` -- {many=True field: callable returning the base queryset
+  of the related rows}, for annotations the nested serializer relies on.
+"""
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.relations import RelatedField
+from rest_framework.response import Response
+
+VALUE, METHOD, NESTED, MANY = range(4)
+
+
+class Row:
+    """Attribute access to the `prefix`ed keys of a values() row, what method fields expect."""
+    __slots__ = ('_row', '_prefix')
+
+    def __init__(self, row, prefix=''):
+        self._row = row
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        try:
+            return self._row[self._prefix + name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class CompiledSerializer:
+    def __init__(self, serializer_class, model=None, prefix=''):
+        serializer = serializer_class()
+        self.model = model or serializer_class.Meta.model
+        self.prefix = prefix
+        self.columns = []
+        self.plan = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            column = prefix + '__'.join(field.source_attrs)
+
+            if isinstance(field, serializers.SerializerMethodField):
+                method = getattr(serializer, field.method_name)
+                self.columns += [prefix + source for source in serializer.method_columns[name]]
+                self.plan.append((name, METHOD, method))
+            elif isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                child = CompiledSerializer(type(field.child), model=relation.related_model)
+                base = getattr(serializer, 'related_querysets', {}).get(name, relation.related_model.objects.all)
+                self.plan.append((name, MANY, (child, relation.field.attname, base)))
+            elif isinstance(field, serializers.BaseSerializer):
+                related_model = self.model._meta.get_field(field.source).related_model
+                child = CompiledSerializer(type(field), model=related_model, prefix=f'{column}__')
+                self.columns += child.columns
+                self.plan.append((name, NESTED, child))
+            elif isinstance(field, RelatedField):
+                # values() returns the primary key, which is what a PrimaryKeyRelatedField renders
+                self.columns.append(column)
+                self.plan.append((name, VALUE, (column, None)))
+            else:
+                self.columns.append(column)
+                self.plan.append((name, VALUE, (column, field.to_representation)))
+
+        self.many = [(name, payload) for name, kind, payload in self.plan if kind is MANY]
+        if self.many:
+            self.columns.append(prefix + 'pk')
+        self.columns = list(dict.fromkeys(self.columns))
+
+    def values(self, queryset, extra=()):
+        """`queryset` as dict rows holding the plan's columns plus `extra` (e.g. ordering fields)."""
+        columns = self.columns + [column for column in extra if column not in self.columns]
+        return queryset.prefetch_related(None).values(*columns)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        related = self.fetch_related(rows)
+        return [self.represent(row, related) for row in rows]
+
+    async def aserialize(self, rows):
+        rows = list(rows)
+        related = await self.afetch_related(rows)
+        return [self.represent(row, related) for row in rows]
+
+    def fetch_related(self, rows):
+        """Rows of the many=True fields, one query per field and level whatever the number of rows."""
+        related = {}
+        for name, (child, fk, base) in self.many:
+            children = list(self.related_rows(rows, child, fk, base))
+            related[name] = (child, self.group(children, fk), child.fetch_related(children))
+        return related
+
+    async def afetch_related(self, rows):
+        related = {}
+        for name, (child, fk, base) in self.many:
+            children = [row async for row in self.related_rows(rows, child, fk, base)]
+            related[name] = (child, self.group(children, fk), await child.afetch_related(children))
+        return related
+
+    def related_rows(self, rows, child, fk, base):
+        parent_ids = [row[self.prefix + 'pk'] for row in rows]
+        return child.values(base().filter(**{f'{fk}__in': parent_ids}).order_by('pk'), extra=[fk])
+
+    def group(self, rows, fk):
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[row[fk]].append(row)
+        return grouped
+
+    def represent(self, row, related):
+        data = {}
+        for name, kind, payload in self.plan:
+            if kind is VALUE:
+                column, to_representation = payload
+                value = row[column]
+                data[name] = value if value is None or to_representation is None else to_representation(value)
+            elif kind is METHOD:
+                data[name] = payload(Row(row, self.prefix))
+            elif kind is NESTED:
+                data[name] = payload.represent(row, {})
+            else:
+                child, grouped, child_related = related[name]
+                data[name] = [child.represent(child_row, child_related)
+                              for child_row in grouped.get(row[self.prefix + 'pk'], [])]
+        return data
+
+
+_compiled = {}
+
+
+def compile_serializer(serializer_class):
+    if serializer_class not in _compiled:
+        _compiled[serializer_class] = CompiledSerializer(serializer_class)
+    return _compiled[serializer_class]
+
+
+class CompiledReadMixin:
+    """
+    Serve list and retrieve through the compiled plan of get_serializer_class().
+    Only for viewsets without object level permissions, rows are plain dicts.
+    `alist` and `aretrieve` are the same actions for store.async_views.
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled, rows = self.get_compiled_rows()
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        row = get_object_or_404(compiled.values(self.filter_queryset(self.get_queryset())), **self.get_lookup())
+        return Response(compiled.serialize([row])[0])
+
+    async def alist(self, request, *args, **kwargs):
+        compiled, rows = self.get_compiled_rows()
+        if self.paginator is None:
+            return Response(await compiled.aserialize([row async for row in rows]))
+
+        if hasattr(self.paginator, 'apaginate_queryset'):
+            page = await self.paginator.apaginate_queryset(rows, request, view=self)
+        else:
+            page = await sync_to_async(self.paginate_queryset)(rows)
+        return self.get_paginated_response(await compiled.aserialize(page))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        # rest_framework.generics.get_object_or_404, a malformed lookup value is a 404 as well
+        try:
+            row = await queryset.aget(**self.get_lookup())
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        return Response((await compiled.aserialize([row]))[0])
+
+    def get_compiled_rows(self):
+        compiled = compile_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset())
+        # the paginator seeks on ordering fields, annotations and its tie breaker, keep them in the rows
+        extra = list(getattr(self, 'ordering_fields', None) or []) + list(queryset.query.annotations)
+        if getattr(self.paginator, 'tie_breaker', None):
+            extra.append(self.paginator.tie_breaker)
+        return compiled, compiled.values(queryset, extra=extra)
+
+    def get_lookup(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return {self.lookup_field: self.kwargs[lookup_url_kwarg]}
@@ -1,9 +1,15 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import ChoiceFilter, FilterSet
+from rest_framework.filters import SearchFilter
 
-from store.models import Product
+from store import stock
+from store.models import Product, StockAlert
+from store.search import search_products
 
 
 class ProductFilter(FilterSet):
+    # ?stock=L|M|H, the levels of store.stock
+    stock = ChoiceFilter(choices=StockAlert.LEVELS, method='filter_stock')
+
     class Meta:
         model = Product
         fields = {
@@ -11,3 +17,16 @@ class ProductFilter(FilterSet):
             # 'category__title': ['icontains', 'istartswith'],
             'name': ['startswith'],
         }
+
+    def filter_stock(self, queryset, name, value):
+        return queryset.filter(stock.level_filter(value))
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    `?search=` backed by the ProductSearchToken inverted index instead of an
+    icontains scan. Results are ranked unless an explicit `?ordering=` is given.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return search_products(queryset, ' '.join(self.get_search_terms(request)))
@@ -0,0 +1,234 @@
+import json
+import random
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import CustomUser
+from store.caching import bump_version, is_shared
+from store.benchmarks import WORDS, benchmark_database, measure, seed_catalog, summarize
+from store.models import Cart, CartItem, Comment, Customer, Order, OrderItem, Product
+from store.search import index_products
+
+# name, method, path, client, query budget
+# paths are formatted with the ids of the seeded objects, budgets are for a cold response
+# cache and a warm user cache (core.authentication), and include the ETag query of
+# conditional detail GETs and the BEGIN/COMMIT of explicit transactions
+ROUTES = [
+    ('product-list', 'GET', '/store/products/', 'staff', 1),
+    ('product-filter', 'GET', '/store/products/?inventory__lt=10&ordering=-unit_price', 'staff', 1),
+    ('product-search', 'GET', '/store/products/?search={word}', 'staff', 1),
+    ('product-detail', 'GET', '/store/products/{product}/', 'staff', 2),
+    # the catalog in one batch, plus the empty one ending the export (--products up to 10000)
+    ('product-export', 'GET', '/store/products/bulk/?batch_size=10000', 'staff', 2),
+    ('product-import', 'POST', '/store/products/bulk/', 'staff', 12),
+    ('product-comments', 'GET', '/store/products/{product}/comments/', 'anonymous', 1),
+    ('category-list', 'GET', '/store/categories/', 'anonymous', 1),
+    ('category-detail', 'GET', '/store/categories/{category}/', 'anonymous', 1),
+    ('category-top', 'GET', '/store/categories/{category}/top/', 'anonymous', 2),
+    ('cart-create', 'POST', '/store/carts/', 'anonymous', 3),
+    ('cart-detail', 'GET', '/store/carts/{cart}/', 'anonymous', 2),
+    ('cart-summary', 'GET', '/store/carts/{cart}/summary/', 'anonymous', 1),
+    ('cart-items', 'GET', '/store/carts/{cart}/items/', 'anonymous', 1),
+    ('cart-item-add', 'POST', '/store/carts/{cart}/items/', 'anonymous', 6),
+    ('cart-item-batch', 'POST', '/store/carts/{cart}/items/batch/', 'anonymous', 6),
+    ('cart-item-update', 'PATCH', '/store/carts/{cart}/items/{cart_item}/', 'anonymous', 2),
+    ('cart-item-delete', 'DELETE', '/store/carts/{fresh_cart}/items/{fresh_cart_item}/', 'anonymous', 2),
+    ('cart-delete', 'DELETE', '/store/carts/{fresh_cart}/', 'anonymous', 6),
+    ('order-list-staff', 'GET', '/store/orders/', 'staff', 2),
+    ('order-list-customer', 'GET', '/store/orders/', 'customer', 2),
+    ('order-detail-customer', 'GET', '/store/orders/{order}/', 'customer', 2),
+    ('order-summary-customer', 'GET', '/store/orders/summary/', 'customer', 1),
+    ('order-create', 'POST', '/store/orders/', 'customer', 25),
+    ('customer-list', 'GET', '/store/customers/', 'staff', 1),
+    ('customer-me', 'GET', '/store/customers/me/', 'customer', 0),
+    ('customer-detail', 'GET', '/store/customers/{customer}/', 'staff', 1),
+    ('customer-private-email', 'GET', '/store/customers/{customer}/send_private_email/', 'staff', 0),
+    ('analytics', 'GET', '/store/analytics/', 'staff', 3),
+    # a single poll, see BENCH_STOCK
+    ('stock-alerts', 'GET', '/store/stock-alerts/?after=0', 'staff', 1),
+    ('metrics', 'GET', '/store/metrics/', 'staff', 0),
+]
+
+# request bodies: name -> function of the ids returning (content type, body)
+BODIES = {
+    'cart-item-add': lambda ids: _json({'product': ids['product'], 'quantity': 1}),
+    'cart-item-batch': lambda ids: _json([{'product': product_id, 'quantity': 1} for product_id in ids['products'][:5]]),
+    'cart-item-update': lambda ids: _json({'quantity': 3}),
+    'order-create': lambda ids: _json({'cart_id': str(ids['fresh_cart'])}),
+    'product-import': lambda ids: ('application/x-ndjson', ''.join(
+        json.dumps({'id': product_id, 'title': f'bench import {product_id}', 'price': 10, 'category': ids['category'],
+                    'inventory': 20, 'description': 'bench'}) + '\n'
+        for product_id in ids['products'][10:])),
+}
+
+# routes consuming the object they target get a new one, made before each request and not measured
+FRESH = {'cart-item-delete', 'cart-delete', 'order-create'}
+
+# one poll of the alert stream instead of a long-lived connection
+BENCH_STOCK = {'STREAM_TIMEOUT': 0, 'POLL_INTERVAL': 0}
+
+
+def _json(data):
+    return 'application/json', json.dumps(data)
+
+
+async def _read(response):
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+class Command(BaseCommand):
+    help = ('Run every store route against a seeded test database, record latency percentiles '
+            'and queries per request, and fail on query budget overruns or latency regressions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--orders', type=int, default=2_000)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--output', help='write the results to this JSON file')
+        parser.add_argument('--baseline', help='compare against the JSON results of a previous run')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='allowed p50 slowdown against the baseline, 0.25 means 25%%')
+
+    def handle(self, *args, **options):
+        if not is_shared():
+            # the budgets count on the user, permission and version entries every worker shares
+            raise CommandError(
+                'The default cache is per process, the query budgets assume a shared one. '
+                'Point CACHES at Redis or Memcached (see store.caching).')
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['products']} products and {options['orders']} orders...")
+            ids, clients = self.seed(options['products'], options['orders'])
+            results = self.run_routes(ids, clients, options['iterations'])
+
+        failures = [f"{name}: {result['queries']} queries, budget {result['budget']}"
+                    for name, result in results.items() if result['queries'] > result['budget']]
+
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())
+            for name, result in results.items():
+                previous = baseline.get(name)
+                if previous is None:
+                    continue
+                if result['latency']['p50'] > previous['latency']['p50'] * (1 + options['threshold']):
+                    failures.append(f"{name}: p50 {result['latency']['p50']}ms, was {previous['latency']['p50']}ms")
+                if result['queries'] > previous['queries']:
+                    failures.append(f"{name}: {result['queries']} queries, was {previous['queries']}")
+
+        for name, result in results.items():
+            self.stdout.write(f"{name:24} {result['queries']:>3}/{result['budget']:<3} queries  {result['latency']} ms")
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+
+        if failures:
+            raise CommandError('Performance regressions:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('All routes within budget.'))
+
+    def seed(self, products, orders):
+        rng = random.Random(2)
+        seed_catalog(products)
+        index_products(Product.objects.all(), batch_size=5000)
+
+        staff = CustomUser.objects.create_superuser('bench-staff', 'staff@example.com', 'bench')
+        buyers = [CustomUser.objects.create_user(f'bench-buyer{index}', f'buyer{index}@example.com', 'bench')
+                  for index in range(20)]
+        buyer = buyers[0]
+        customer_ids = list(Customer.objects.filter(user__in=buyers).values_list('id', flat=True))
+        product_rows = list(Product.objects.values_list('id', 'unit_price')[:500])
+
+        Order.objects.bulk_create([Order(customer_id=rng.choice(customer_ids)) for _ in range(orders)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, product_id=product_id, unit_price=unit_price, quantity=rng.randint(1, 5))
+            for order_id in Order.objects.values_list('id', flat=True)
+            for product_id, unit_price in rng.sample(product_rows, 3)
+        ], batch_size=5000)
+
+        product = Product.objects.order_by('id').first()
+        # a popular product, only the approved comments are listed
+        Comment.objects.bulk_create([
+            Comment(product=product, name='bench', body='bench', status=status)
+            for _ in range(1000)
+            for status in (Comment.COMMENT_STATUS_APPROVED, Comment.COMMENT_STATUS_WAITING)])
+        Product.objects.filter(pk=product.pk).rebuild_comment_counters()
+
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=2) for product_id, _ in product_rows[:20]])
+        # enough stock for every order the order-create route places
+        Product.objects.filter(id__in=[product_id for product_id, _ in product_rows[:20]]).update(inventory=100_000)
+
+        ids = {
+            'product': product.id,
+            'products': [product_id for product_id, _ in product_rows[:20]],
+            'category': product.category_id,
+            'cart': cart.id,
+            'cart_item': cart.items.order_by('id').values_list('id', flat=True).first(),
+            'order': Order.objects.filter(customer__user=buyer).values_list('id', flat=True).first(),
+            'customer': buyer.customer.id,
+            'word': WORDS[0],
+        }
+
+        clients = {'anonymous': APIClient()}
+        for name, user in (('staff', staff), ('customer', buyer)):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(user).access_token}')
+            # resolves the user and customer into the user cache, as any earlier request would have
+            client.get('/store/customers/me/')
+            clients[name] = client
+        return ids, clients
+
+    def fresh_cart(self, ids):
+        cart = Cart.objects.create()
+        items = CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=1) for product_id in ids['products'][:2]])
+        return {**ids, 'fresh_cart': cart.id, 'fresh_cart_item': items[0].id}
+
+    def run_routes(self, ids, clients, iterations):
+        results = {}
+        for name, method, path, client_name, budget in ROUTES:
+            client = clients[client_name]
+
+            def setup():
+                return self.fresh_cart(ids) if name in FRESH else ids
+
+            def request(route_ids):
+                url = path.format(**route_ids)
+                content_type, body = BODIES[name](route_ids) if name in BODIES else ('application/json', '')
+                response = client.generic(method, url, body, content_type=content_type)
+                if response.status_code >= 400:
+                    raise CommandError(f'{name}: {method} {url} returned {response.status_code}')
+                if response.streaming:
+                    # the queries of a streaming response run as it is read
+                    if response.is_async:
+                        async_to_sync(_read)(response)
+                    else:
+                        b''.join(response.streaming_content)
+
+            # the first request runs with a cold response cache, that is what the budget covers
+            for model in apps.get_app_config('store').get_models():
+                bump_version(model)
+            route_ids = setup()
+            with override_settings(STORE_STOCK={**getattr(settings, 'STORE_STOCK', {}), **BENCH_STOCK}):
+                with CaptureQueriesContext(connection) as queries:
+                    request(route_ids)
+                # read before the next requests clear the connection's query log
+                query_count = len(queries)
+                timings = measure(request, iterations, setup)
+
+            results[name] = {
+                'method': method,
+                'path': path,
+                'budget': budget,
+                'queries': query_count,
+                'latency': summarize(timings),
+            }
+        return results
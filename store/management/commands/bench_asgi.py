@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import CustomUser
+from store.benchmarks import benchmark_database, seed_catalog, summarize
+from store.models import Cart, CartItem, Product
+
+# the routes served by store.async_views, formatted with the ids of the seeded objects
+ROUTES = [
+    '/store/products/',
+    '/store/products/{product}/',
+    '/store/categories/',
+    '/store/carts/{cart}/',
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the async read routes under ASGI with the WSGI path '
+            'for many concurrent connections on a seeded test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--connections', type=int, default=100, help='concurrent client connections')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--client-delay', type=float, default=0.1,
+                            help='seconds a slow client keeps the connection after the response')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            urls, token = self.seed(options['products'])
+            requests = [urls[index % len(urls)] for index in range(options['requests'])]
+
+            for label, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                cache.clear()
+                start = time.perf_counter()
+                timings = run(requests, token, options)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{label}: {int(len(requests) / elapsed)} requests/s  {summarize(timings)} ms per request')
+
+    def seed(self, products):
+        seed_catalog(products)
+        staff = CustomUser.objects.create_superuser('bench-staff', 'staff@example.com', 'bench')
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=2)
+            for product_id in Product.objects.values_list('id', flat=True)[:10]])
+
+        ids = {'product': Product.objects.order_by('id').values_list('id', flat=True).first(), 'cart': cart.id}
+        urls = [route.format(**ids) for route in ROUTES]
+        return urls, f'JWT {RefreshToken.for_user(staff).access_token}'
+
+    def run_wsgi(self, requests, token, options):
+        application = get_wsgi_application()
+        factory = RequestFactory(SERVER_NAME='localhost', headers={'Authorization': token})
+        # a worker stays busy until the slow client has read the whole response,
+        # other connections wait for a free worker
+        workers = threading.BoundedSemaphore(options['workers'])
+
+        def request(url):
+            statuses = []
+            with workers:
+                body = application(factory.get(url).environ, lambda status, headers: statuses.append(status))
+                b''.join(body)
+                body.close()
+                time.sleep(options['client_delay'])
+            if not statuses[0].startswith('200'):
+                raise CommandError(f'WSGI {url} returned {statuses[0]}')
+
+        def connection(urls):
+            return [self.timed(request, url) for url in urls]
+
+        with ThreadPoolExecutor(max_workers=options['connections']) as pool:
+            return self.flatten(pool.map(connection, self.split(requests, options['connections'])))
+
+    def run_asgi(self, requests, token, options):
+        application = get_asgi_application()
+
+        async def request(url):
+            # what an ASGI server does for one GET, see django.core.handlers.asgi.ASGIHandler
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+                'method': 'GET', 'path': url, 'raw_path': url.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'localhost'), (b'authorization', token.encode())],
+                'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+            }
+            done = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            await application(scope, receive, send)
+            done.set()
+            # the event loop serves other connections while a slow client reads
+            await asyncio.sleep(options['client_delay'])
+            if sent[0]['status'] != 200:
+                raise CommandError(f"ASGI {url} returned {sent[0]['status']}")
+
+        async def connection(urls):
+            timings = []
+            for url in urls:
+                start = time.perf_counter()
+                await request(url)
+                timings.append(time.perf_counter() - start)
+            return timings
+
+        async def run():
+            return await asyncio.gather(*(connection(urls) for urls in self.split(requests, options['connections'])))
+
+        return self.flatten(asyncio.run(run()))
+
+    def timed(self, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+    def split(self, requests, connections):
+        return [requests[index::connections] for index in range(connections)]
+
+    def flatten(self, timings):
+        return [timing for connection in timings for timing in connection]
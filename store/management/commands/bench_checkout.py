@@ -0,0 +1,96 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import Sum
+from rest_framework import serializers
+
+from core.models import CustomUser
+from store.benchmarks import benchmark_database, seed_catalog
+from store.checkout import place_order
+from store.models import Cart, CartItem, Customer, OrderItem, OutboxEvent, Product
+
+
+class Command(BaseCommand):
+    help = 'Measure checkout throughput (orders per second) with concurrent workers on a seeded test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--items-per-cart', type=int, default=5)
+        parser.add_argument('--retries', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if options['items_per_cart'] > options['products']:
+            raise CommandError('--items-per-cart cannot exceed --products')
+
+        with benchmark_database():
+            seed_catalog(options['products'], categories=10)
+            # scarce stock so some checkouts compete for the last units and get rejected
+            demand = options['orders'] * options['items_per_cart'] // options['products']
+            Product.objects.update(inventory=max(1, demand * 4 // 5))
+            initial_inventory = Product.objects.aggregate(total=Sum('inventory'))['total']
+
+            users = [CustomUser.objects.create_user(f'bench{index}', f'bench{index}@example.com', 'bench')
+                     for index in range(options['threads'])]
+            customer_ids = list(Customer.objects.filter(user__in=users).values_list('id', flat=True))
+            product_ids = list(Product.objects.values_list('id', flat=True))
+
+            carts = [Cart.objects.create() for _ in range(options['orders'])]
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product_ids[(index + offset) % len(product_ids)], quantity=1)
+                for index, cart in enumerate(carts)
+                for offset in range(options['items_per_cart'])
+            ])
+
+            outcome = {'placed': 0, 'rejected': 0, 'errors': 0, 'retries': 0}
+            lock = threading.Lock()
+
+            def checkout(cart_id, customer_id):
+                # lock waits and deadlock victims (or SQLite's "database is locked") are retried like a client would
+                for attempt in range(options['retries'] + 1):
+                    try:
+                        place_order(cart_id, customer_id)
+                        return 'placed', attempt
+                    except serializers.ValidationError:
+                        return 'rejected', attempt
+                    except OperationalError:
+                        time.sleep(0.001 * (attempt + 1))
+                return 'errors', options['retries']
+
+            def worker(customer_id, cart_ids):
+                for cart_id in cart_ids:
+                    result, retries = checkout(cart_id, customer_id)
+                    with lock:
+                        outcome[result] += 1
+                        outcome['retries'] += retries
+                close_old_connections()
+                connection.close()
+
+            threads = [
+                threading.Thread(target=worker, args=(customer_id, [cart.id for cart in carts[index::len(customer_ids)]]))
+                for index, customer_id in enumerate(customer_ids)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            sold = OrderItem.objects.aggregate(total=Sum('quantity'))['total'] or 0
+            remaining = Product.objects.aggregate(total=Sum('inventory'))['total']
+            consistent = (initial_inventory - sold == remaining
+                          and not Product.objects.filter(inventory__lt=0).exists())
+            # written in the order's transaction along with the outbox event, see store.checkout
+            counted = (Product.objects.aggregate(total=Sum('units_sold'))['total'] == sold
+                       and OutboxEvent.objects.count() == outcome['placed'])
+
+            self.stdout.write(
+                f"{outcome['placed']} orders placed, {outcome['rejected']} rejected for stock, "
+                f"{outcome['errors']} failed after retries ({outcome['retries']} retries) in {elapsed:.2f}s "
+                f"({outcome['placed'] / elapsed:.1f} orders/s, {options['threads']} threads)")
+            self.stdout.write(f'Inventory consistent: {consistent}')
+            self.stdout.write(f'Sales counters and outbox consistent: {counted}')
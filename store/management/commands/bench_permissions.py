@@ -0,0 +1,79 @@
+import copy
+import time
+
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import permissions
+from rest_framework.test import APIRequestFactory
+
+from core import permissions as core_permissions
+from core.models import CustomUser
+from store.benchmarks import benchmark_database, summarize
+from store.permissions import CustomDjangoModelPermissions, SendPrivateEmail
+from store.views import CustomerViewSet, ProductViewSet
+
+
+class UncachedModelPermissions(permissions.DjangoModelPermissions):
+    # the previous CustomDjangoModelPermissions, for comparison
+    def __init__(self):
+        self.perms_map = copy.deepcopy(self.perms_map)
+        self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
+
+
+class UncachedSendPrivateEmail(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.has_perm('store.send_private_email'))
+
+
+class Command(BaseCommand):
+    help = ('Measure the cost per request of the permission checks of ProductViewSet and '
+            'send_private_email, with and without the per-user permission cache, on a test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user = self.seed()
+            factory = APIRequestFactory()
+            cases = [
+                ('product-list', ProductViewSet, 'list', [UncachedModelPermissions, CustomDjangoModelPermissions]),
+                ('send-private-email', CustomerViewSet, 'send_private_email',
+                 [UncachedSendPrivateEmail, SendPrivateEmail]),
+            ]
+
+            for name, viewset, action, permission_classes in cases:
+                for label, permission_class in zip(('uncached', 'cached'), permission_classes):
+                    cache.clear()
+                    core_permissions.lru.clear()
+                    # every request authenticates a fresh user instance, as CachedJWTAuthentication does
+                    users = [CustomUser.objects.get(pk=user.pk) for _ in range(options['requests'])]
+                    view = viewset(action=action, format_kwarg=None)
+
+                    timings = []
+                    with CaptureQueriesContext(connection) as queries:
+                        for request_user in users:
+                            request = factory.get('/')
+                            request.user = request_user
+                            view.request = request
+                            start = time.perf_counter()
+                            allowed = permission_class().has_permission(request, view)
+                            timings.append(time.perf_counter() - start)
+                            if not allowed:
+                                raise CommandError(f'{name}: {label} check denied the request')
+
+                    self.stdout.write(
+                        f'{name:20} {label:9} {len(queries) / len(users):.2f} queries/request  '
+                        f'{summarize(timings)} ms')
+
+    def seed(self):
+        group = Group.objects.create(name='bench-staff')
+        group.permissions.set(Permission.objects.filter(
+            content_type__app_label='store',
+            codename__in=['view_product', 'change_product', 'send_private_email']))
+        user = CustomUser.objects.create_user('bench-staff', 'staff@example.com', 'bench', is_staff=True)
+        user.groups.add(group)
+        return user
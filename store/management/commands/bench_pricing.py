@@ -0,0 +1,98 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from core.models import CustomUser
+from store import pricing
+from store.benchmarks import benchmark_database, measure, seed_catalog, summarize
+from store.caching import bump_version
+from store.models import Discount, Product
+
+
+class Command(BaseCommand):
+    help = ('Measure the pricing of a 100 product list page: discounts prefetched and applied in Python, '
+            'prices annotated by the database, and the API route, on a seeded test database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--discounted', type=float, default=0.3, help='share of products with discounts')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            staff = self.seed(options['products'], options['discounted'])
+
+            def prefetched():
+                return {
+                    product.id: (
+                        pricing.discounted_price(product.unit_price, self.best_discount(product)),
+                        pricing.price_after_tax(product.unit_price, self.best_discount(product)),
+                    )
+                    for product in Product.objects.order_by('id').prefetch_related('discounts')[:page_size]
+                }
+
+            def annotated():
+                rows = Product.objects.with_prices().order_by('id').values_list(
+                    'id', 'discounted_price', 'price_after_tax')[:page_size]
+                return {product_id: (discounted, taxed) for product_id, discounted, taxed in rows}
+
+            client = APIClient()
+            client.force_authenticate(staff)
+
+            def api():
+                # cold response cache, the page is priced by the query every time
+                bump_version(Product)
+                response = client.get(f'/store/products/?page_size={page_size}')
+                if response.status_code != 200:
+                    raise CommandError(f'/store/products/ returned {response.status_code}')
+
+            if prefetched() != annotated():
+                raise CommandError('annotated prices differ from the prices computed in Python')
+
+            for label, func in (('prefetch', prefetched), ('annotated', annotated), ('api', api)):
+                queries = self.count_queries(func)
+                timings = measure(func, options['repeat'])
+                self.stdout.write(f'{label:10} {queries:>2} queries  {summarize(timings)} ms')
+
+    def seed(self, products, discounted):
+        rng = random.Random(4)
+        seed_catalog(products)
+        Discount.objects.bulk_create([
+            Discount(discount=rng.choice([5, 7.5, 10, 12.5, 15, 20, 33.3, 50]), description=f'bench {index}')
+            for index in range(20)])
+        discount_ids = list(Discount.objects.values_list('id', flat=True))
+
+        Link = Product.discounts.through
+        Link.objects.bulk_create([
+            Link(product_id=product_id, discount_id=discount_id)
+            for product_id in Product.objects.values_list('id', flat=True)
+            if rng.random() < discounted
+            for discount_id in rng.sample(discount_ids, rng.randint(1, 3))
+        ], batch_size=5000)
+        # bulk_create bypasses the m2m signals
+        Product.objects.refresh_best_discounts()
+
+        return CustomUser.objects.create_superuser('bench-staff', 'staff@example.com', 'bench')
+
+    def count_queries(self, func):
+        # not CaptureQueriesContext, the test client resets the query log at each request when DEBUG is on
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            func()
+        return len(queries)
+
+    def best_discount(self, product):
+        percentages = [Decimal(str(discount.discount)) for discount in product.discounts.all()]
+        return min(max([*percentages, Decimal(0)]), pricing.HUNDRED)
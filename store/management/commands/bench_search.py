@@ -0,0 +1,47 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from store.benchmarks import WORDS, benchmark_database, measure, seed_catalog, summarize
+from store.models import Product
+from store.search import index_products, search_products
+
+
+class Command(BaseCommand):
+    help = 'Compare the inverted-index product search with the icontains SearchFilter on a seeded test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        queries = [' '.join(rng.sample(WORDS[:512], rng.choice([1, 2]))) for _ in range(options['queries'])]
+        page_size = options['page_size']
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            seed_catalog(options['products'])
+            index_products(Product.objects.all(), batch_size=5000)
+
+            # what rest_framework.filters.SearchFilter builds for search_fields = ['name']
+            def icontains(queryset, query):
+                for term in query.split():
+                    queryset = queryset.filter(name__icontains=term)
+                return queryset.order_by('id')
+
+            def run(search, with_count):
+                def func():
+                    for query in queries:
+                        queryset = search(Product.objects.all(), query)
+                        if with_count:
+                            queryset.count()
+                        list(queryset[:page_size])
+                return func
+
+            for label, search in (('SearchFilter (icontains)', icontains), ('ProductSearchFilter (index)', search_products)):
+                for with_count in (False, True):
+                    timings = [total / len(queries) for total in measure(run(search, with_count), repeat=3)]
+                    suffix = ' + COUNT' if with_count else ''
+                    self.stdout.write(f'{label}{suffix}: {summarize(timings)} ms per query')
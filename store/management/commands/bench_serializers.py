@@ -0,0 +1,82 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from core.models import CustomUser
+from store.benchmarks import benchmark_database, measure, seed_catalog, summarize
+from store.compiled_serializers import compile_serializer
+from store.models import Cart, CartItem, Category, Customer, Order, OrderItem, Product
+from store.serializers import CartSerializer, CategorySerializer, OrderForAdminSerializer, OrderSerializer, \
+    ProductSerializer
+
+
+class Command(BaseCommand):
+    help = ('Compare rows serialized per second by the DRF serializers and their compiled read path '
+            'on a seeded test database, and check both render the same JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--rows', type=int, default=1000, help='rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['products']} products...")
+            self.seed(options['products'], rows)
+
+            order_items = Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+            cases = [
+                ('product', ProductSerializer, Product.objects.with_prices().order_by('id')),
+                ('category', CategorySerializer, Category.objects.order_by('id')),
+                ('cart', CartSerializer, Cart.objects.with_totals().prefetch_related(
+                    Prefetch('items', queryset=CartItem.objects.select_related('product').with_totals()))),
+                ('order', OrderSerializer, Order.objects.prefetch_related(order_items).order_by('id')),
+                ('order-admin', OrderForAdminSerializer,
+                 Order.objects.prefetch_related(order_items).select_related('customer__user').order_by('id')),
+            ]
+
+            renderer = JSONRenderer()
+            for name, serializer_class, queryset in cases:
+                compiled = compile_serializer(serializer_class)
+
+                def drf():
+                    return serializer_class(queryset[:rows], many=True).data
+
+                def fast():
+                    return compiled.serialize(compiled.values(queryset)[:rows])
+
+                drf_data, fast_data = drf(), fast()
+                if renderer.render(drf_data) != renderer.render(fast_data):
+                    raise CommandError(f'{name}: compiled output differs from {serializer_class.__name__}')
+
+                count = len(drf_data)
+                for label, func in (('drf', drf), ('compiled', fast)):
+                    timings = measure(func, options['repeat'])
+                    per_second = int(count / min(timings))
+                    self.stdout.write(f'{name:12} {label:9} {per_second:>9} rows/s  {summarize(timings)} ms')
+
+    def seed(self, products, rows):
+        rng = random.Random(3)
+        seed_catalog(products)
+        product_rows = list(Product.objects.values_list('id', 'unit_price')[:500])
+
+        user = CustomUser.objects.create_user('bench-buyer', 'buyer@example.com', 'bench', first_name='Bench')
+        customer_id = Customer.objects.values_list('id', flat=True).get(user=user)
+
+        Cart.objects.bulk_create([Cart() for _ in range(rows)])
+        CartItem.objects.bulk_create([
+            CartItem(cart_id=cart_id, product_id=product_id, quantity=rng.randint(1, 5))
+            for cart_id in Cart.objects.values_list('id', flat=True)
+            for product_id, _ in rng.sample(product_rows, 3)
+        ], batch_size=5000)
+
+        Order.objects.bulk_create([Order(customer_id=customer_id) for _ in range(rows)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order_id, product_id=product_id, unit_price=unit_price, quantity=rng.randint(1, 5))
+            for order_id in Order.objects.values_list('id', flat=True)
+            for product_id, unit_price in rng.sample(product_rows, 3)
+        ], batch_size=5000)
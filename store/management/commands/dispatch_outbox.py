@@ -0,0 +1,92 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store import outbox
+from store.models import OutboxEvent
+
+
+class Command(BaseCommand):
+    help = ('Deliver the outbox events (see store.outbox) on a thread or process pool, '
+            'until interrupted or, with --once, until none is due')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=['thread', 'process'], help='STORE_OUTBOX["POOL"] by default')
+        parser.add_argument('--workers', type=int, help='STORE_OUTBOX["WORKERS"] by default')
+        parser.add_argument('--batch-size', type=int, help='events claimed at a time, STORE_OUTBOX["BATCH_SIZE"] by default')
+        parser.add_argument('--poll', type=float, default=1, help='seconds to sleep when no event is due')
+        parser.add_argument('--once', action='store_true', help='exit once no event is due')
+        parser.add_argument('--keep-days', type=int, default=7, help='days dispatched events are kept')
+
+    def handle(self, *args, **options):
+        pool = options['pool'] or outbox.get_setting('POOL', 'thread')
+        workers = options['workers'] or outbox.get_setting('WORKERS', 4)
+        batch_size = options['batch_size'] or outbox.get_setting('BATCH_SIZE', 100)
+        if workers <= 0 or batch_size <= 0:
+            raise CommandError('--workers and --batch-size must be positive')
+
+        if pool == 'process':
+            # spawned rather than forked, the children must not share the parent's database connections
+            executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(workers, thread_name_prefix='outbox')
+
+        dispatched = failed = dead = 0
+        start = time.perf_counter()
+        self.stdout.write(f'Dispatching on {workers} {pool} workers, {batch_size} events per batch.')
+        self.report_dead_letters()
+
+        with executor:
+            try:
+                while True:
+                    events = outbox.claim(batch_size)
+                    if not events:
+                        purged = outbox.purge(timezone.now() - timedelta(days=options['keep_days']))
+                        if purged:
+                            self.stdout.write(f'{purged} dispatched events purged')
+                        if options['once']:
+                            break
+                        time.sleep(options['poll'])
+                        continue
+
+                    futures = [(event_id, attempts, executor.submit(outbox.deliver, topic, payload))
+                               for event_id, topic, payload, attempts in events]
+                    done, failures = [], []
+                    for event_id, attempts, future in futures:
+                        try:
+                            error = future.result()
+                        except Exception as exc:
+                            # the worker process died, the event is retried like a failed delivery
+                            error = repr(exc)
+                        if error is None:
+                            done.append(event_id)
+                        else:
+                            failures.append((event_id, attempts, error))
+                    dead += outbox.complete(done, failures)
+
+                    dispatched += len(done)
+                    failed += len(failures)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f'{dispatched} dispatched, {failed} failed, {dead} dead-lettered  '
+                        f'{int((dispatched + failed) / elapsed)} events/s')
+            except KeyboardInterrupt:
+                # the events claimed and not completed are claimed again once their lease ends
+                pass
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{dispatched} events dispatched and {failed} failed in {elapsed:.1f}s.'))
+        self.report_dead_letters()
+
+    def report_dead_letters(self):
+        count = OutboxEvent.objects.dead().count()
+        if count:
+            self.stdout.write(self.style.WARNING(
+                f'{count} events are dead-lettered, retry them from the admin once their receivers are fixed.'))
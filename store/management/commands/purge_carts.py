@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.models import Cart, CartItem, cart_expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = ('Delete the carts older than STORE_CART_TTL and their items, in chunks of short '
+            'transactions so no lock is held for long')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='carts deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='seconds to sleep between chunks')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        # fixed for the whole run, carts expiring meanwhile are left for the next one
+        cutoff = cart_expiry_cutoff()
+        carts = items = 0
+        start = time.perf_counter()
+
+        while True:
+            # oldest first, served by the created_at index
+            ids = list(Cart.objects.expired(cutoff).order_by('created_at').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                _, deleted = Cart.objects.filter(id__in=ids).delete()
+            carts += deleted.get(Cart._meta.label, 0)
+            items += deleted.get(CartItem._meta.label, 0)
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{carts} carts, {items} items deleted  {int((carts + items) / elapsed)} rows/s')
+            if len(ids) < batch_size:
+                break
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{carts} expired carts and {items} items purged in {elapsed:.1f}s.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.caching import bump_version
+from store.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute Category.products_count and Category.products_in_stock_count from the product table'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Category.objects.rebuild_product_counters()
+            bump_version(Category)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} categories rebuilt.'))
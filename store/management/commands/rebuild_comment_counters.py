@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.caching import bump_version
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute Product.approved_comments_count from the comment table'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Product.objects.rebuild_comment_counters()
+            bump_version(Product)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} products rebuilt.'))
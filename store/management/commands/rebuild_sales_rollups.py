@@ -0,0 +1,50 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from store import analytics
+from store.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Recompute the daily sales rollups (ProductSalesDay, CategorySalesDay) from the order items, '
+            'a few days per transaction')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='first day, the first order by default')
+        parser.add_argument('--end', type=date.fromisoformat, help='last day, today by default')
+        parser.add_argument('--days', type=int, default=7, help='days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0:
+            raise CommandError('--days must be positive')
+
+        start = options['start']
+        if start is None:
+            first = Order.objects.aggregate(first=Min('datetime_created'))['first']
+            if first is None:
+                self.stdout.write('No orders.')
+                return
+            start = timezone.localdate(first)
+        end = options['end'] or timezone.localdate()
+        if start > end:
+            raise CommandError('--start is after --end')
+
+        products = categories = 0
+        begin = time.perf_counter()
+        window = timedelta(days=options['days'])
+
+        while start <= end:
+            last = min(start + window - timedelta(days=1), end)
+            rebuilt = analytics.rebuild_days(start, last)
+            products += rebuilt[0]
+            categories += rebuilt[1]
+            self.stdout.write(f'{start} - {last}: {rebuilt[0]} product days, {rebuilt[1]} category days')
+            start = last + timedelta(days=1)
+
+        elapsed = time.perf_counter() - begin
+        self.stdout.write(self.style.SUCCESS(
+            f'{products} product days and {categories} category days rebuilt in {elapsed:.1f}s.'))
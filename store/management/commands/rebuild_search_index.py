@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.caching import bump_version
+from store.models import Product
+from store.search import index_products
+
+
+class Command(BaseCommand):
+    # the tokens of each batch are replaced in its own transaction, searches keep working meanwhile
+    help = 'Rebuild the product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = index_products(Product.objects.all(), batch_size=options['batch_size'])
+        bump_version(Product)
+
+        self.stdout.write(self.style.SUCCESS(f'{indexed} products indexed.'))
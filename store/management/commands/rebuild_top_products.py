@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = ('Recompute Product.units_sold from the order items, in chunks of short transactions, '
+            'then Category.top_product')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='products rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        products = 0
+        last_id = 0
+        start = time.perf_counter()
+
+        while True:
+            ids = list(Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                products += Product.objects.filter(pk__in=ids).rebuild_units_sold()
+            last_id = ids[-1]
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{products} products rebuilt  {int(products / elapsed)} rows/s')
+            if len(ids) < batch_size:
+                break
+
+        with transaction.atomic():
+            categories = Category.objects.rebuild_top_products()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{products} products and {categories} categories rebuilt in {elapsed:.1f}s.'))
@@ -0,0 +1,149 @@
+"""
+In-process request metrics, filled by store.middleware.QueryMetricsMiddleware
+and rendered in the Prometheus text format by the `metrics` view.
+
+Statements are exported by fingerprint, never as SQL: literals and IN lists
+are replaced before hashing, so the labels hold no data and a statement keeps
+its fingerprint whatever its parameters. `fingerprint(sql)` maps a statement
+to its label.
+"""
+import hashlib
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .caching import response_cache_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\((?:\s*\?\s*,)*\s*\?\s*\)')
+
+
+def get_setting(name, default):
+    return getattr(settings, 'STORE_METRICS', {}).get(name, default)
+
+
+def fingerprint(sql):
+    """Short hash of `sql` with its literals and the length of its IN lists left out."""
+    normalized = _LISTS.sub('(?+)', _LITERALS.sub('?', sql.replace('%s', '?')))
+    return hashlib.md5(' '.join(normalized.split()).encode()).hexdigest()[:16]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.sql_duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.duplicate_queries = Histogram(QUERY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        # min-heap of (seconds, fingerprint), the slowest statements seen on this route
+        self.worst_queries = []
+
+
+_lock = threading.Lock()
+_routes = defaultdict(RouteMetrics)
+
+
+def record(view, route, method, duration, queries, response_size):
+    """`queries` is a list of (sql, seconds) pairs executed while serving the request."""
+    worst_limit = get_setting('WORST_QUERIES', 5)
+    sql_texts = [sql for sql, _ in queries]
+
+    with _lock:
+        metrics = _routes[(view, route, method)]
+        metrics.duration.observe(duration)
+        metrics.sql_duration.observe(sum(seconds for _, seconds in queries))
+        metrics.queries.observe(len(queries))
+        # the same statement many times in one request is the N+1 signature
+        metrics.duplicate_queries.observe(len(sql_texts) - len(set(sql_texts)))
+        if response_size is not None:
+            metrics.response_size.observe(response_size)
+        floor = metrics.worst_queries[0][0] if len(metrics.worst_queries) >= worst_limit else None
+
+    # only the statements slower than the route's current worst ones are fingerprinted, without the lock
+    candidates = heapq.nlargest(worst_limit, (query for query in queries if floor is None or query[1] > floor),
+                                key=lambda query: query[1])
+    if not candidates:
+        return
+    entries = [(seconds, fingerprint(sql)) for sql, seconds in candidates]
+
+    with _lock:
+        for entry in entries:
+            if len(metrics.worst_queries) < worst_limit:
+                heapq.heappush(metrics.worst_queries, entry)
+            elif entry[0] > metrics.worst_queries[0][0]:
+                heapq.heapreplace(metrics.worst_queries, entry)
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', ' ').replace('"', '\\"')
+
+
+def render_prometheus():
+    histograms = [
+        ('store_request_duration_seconds', 'duration', 'Wall time of the request'),
+        ('store_request_sql_duration_seconds', 'sql_duration', 'Total time spent in SQL'),
+        ('store_request_queries', 'queries', 'SQL statements per request'),
+        ('store_request_duplicate_queries', 'duplicate_queries', 'Repeated identical SQL statements per request'),
+        ('store_response_size_bytes', 'response_size', 'Size of the response body'),
+    ]
+
+    with _lock:
+        routes = sorted(_routes.items())
+        lines = []
+        for name, attribute, description in histograms:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (view, route, method), metrics in routes:
+                labels = f'view="{_escape(view)}",route="{_escape(route)}",method="{method}"'
+                lines.extend(getattr(metrics, attribute).render(name, labels))
+
+        lines.append('# HELP store_worst_query_seconds Slowest SQL statements seen per route')
+        lines.append('# TYPE store_worst_query_seconds gauge')
+        for (view, route, method), metrics in routes:
+            for rank, (seconds, statement) in enumerate(sorted(metrics.worst_queries, reverse=True), start=1):
+                lines.append(
+                    f'store_worst_query_seconds{{view="{_escape(view)}",route="{_escape(route)}",'
+                    f'method="{method}",rank="{rank}",fingerprint="{statement}"}} {seconds}')
+
+    cache_stats = response_cache_stats()
+    lines.append('# HELP store_response_cache_total Response cache lookups')
+    lines.append('# TYPE store_response_cache_total counter')
+    lines.append(f'store_response_cache_total{{result="hit"}} {cache_stats["hits"]}')
+    lines.append(f'store_response_cache_total{{result="miss"}} {cache_stats["misses"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+
+# (sql, seconds) pairs of the request being served, None outside of a request.
+# A context variable follows the request into the threads of sync_to_async,
+# where the async ORM runs its queries on that thread's connections.
+_queries = ContextVar('store_request_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((sql, time.perf_counter() - start))
+
+
+def install_query_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class QueryMetricsMiddleware:
+    """
+    Record wall time, SQL statements and timings, and response size per view
+    and route into store.metrics. Removed from the stack at startup when
+    STORE_METRICS['ENABLED'] is false, so it costs nothing when off.
+
+    Async capable, so the async read views in store.async_views are not forced
+    back into a thread by the middleware chain.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.get_setting('ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+        # every connection gets the wrapper, connections are per thread and opened lazily
+        connection_created.connect(install_query_wrapper, dispatch_uid='store.middleware.install_query_wrapper')
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = []
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _queries.reset(token)
+        return self.record(request, response, time.perf_counter() - start, queries)
+
+    async def __acall__(self, request):
+        queries = []
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _queries.reset(token)
+        return self.record(request, response, time.perf_counter() - start, queries)
+
+    def record(self, request, response, duration, queries):
+        match = request.resolver_match
+        if match is None:
+            return response
+
+        size = None if response.streaming else len(response.content)
+        metrics.record(match.view_name or match._func_path, match.route, request.method, duration, queries, size)
+        return response
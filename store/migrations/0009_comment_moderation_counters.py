@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_approved_comments_count(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Comment = apps.get_model('store', 'Comment')
+
+    counters = (Comment.objects.filter(product=OuterRef('pk'), status='a')
+                .order_by().values('product').annotate(c=Count('id')).values('c'))
+    Product.objects.update(approved_comments_count=Coalesce(Subquery(counters), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_order_customer_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='approved_comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['product', 'status', 'datetime_created'], name='store_comme_product_fd5c95_idx'),
+        ),
+        migrations.RunPython(populate_approved_comments_count, migrations.RunPython.noop),
+    ]
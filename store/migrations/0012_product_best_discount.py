@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:13
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+
+def populate_best_discount(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+
+    best = (Product.discounts.through.objects.filter(product=OuterRef('pk'))
+            .order_by().values('product').annotate(best=Max('discount__discount')).values('best'))
+    output = DecimalField(max_digits=5, decimal_places=2)
+    percentage = Coalesce(Subquery(best, output_field=output), Value(Decimal(0)), output_field=output)
+    Product.objects.update(
+        best_discount=Least(Greatest(percentage, Value(Decimal(0))), Value(Decimal(100)), output_field=output))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_order_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='best_discount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=5),
+        ),
+        migrations.RunPython(populate_best_discount, migrations.RunPython.noop),
+    ]
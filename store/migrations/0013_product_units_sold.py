@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_units_sold(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    Product = apps.get_model('store', 'Product')
+
+    sold = (OrderItem.objects.filter(product=OuterRef('pk')).exclude(order__status='c')
+            .order_by().values('product').annotate(units=Sum('quantity')).values('units'))
+    Product.objects.update(units_sold=Coalesce(Subquery(sold), 0))
+
+    best = Product.objects.filter(category=OuterRef('pk'), units_sold__gt=0).order_by('-units_sold', '-id')
+    Category.objects.update(top_product=Subquery(best.values('id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_best_discount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'units_sold', 'id'], name='store_produ_categor_99bd8d_idx'),
+        ),
+        migrations.RunPython(populate_units_sold, migrations.RunPython.noop),
+    ]
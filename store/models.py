@@ -1,14 +1,77 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, DecimalField, Exists, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, \
+    Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from datetime import timedelta
 from uuid import uuid4
 
+from . import pricing
+
+
+class CategoryQuerySet(models.QuerySet):
+    def adjust_product_counters(self, products=0, in_stock=0):
+        if not products and not in_stock:
+            return 0
+        return self.update(
+            products_count=F('products_count') + products,
+            products_in_stock_count=F('products_in_stock_count') + in_stock,
+        )
+
+    def adjust_in_stock_counters(self, changes):
+        """Add `changes` ({category_id: products}) to products_in_stock_count with a single UPDATE."""
+        if not changes:
+            return 0
+        increments = Case(
+            *[When(pk=category_id, then=Value(count)) for category_id, count in changes.items()],
+            default=Value(0), output_field=models.IntegerField())
+        return self.filter(pk__in=changes).update(products_in_stock_count=F('products_in_stock_count') + increments)
+
+    def promote_top_products(self, products):
+        """
+        Make each of `products` ({category_id: (product_id, units_sold)}) the top
+        product of its category when it outsells the current one. Sales only
+        grow here (cancellations rebuild the categories they touch), so the
+        current top is the only one to beat.
+        """
+        if not products:
+            return 0
+        # compared in the UPDATE itself, concurrent orders cannot demote a better seller
+        tops = Case(
+            *[When(Q(pk=category_id) & ~Exists(Product.objects.filter(pk=OuterRef('top_product_id'),
+                                                                      units_sold__gte=units_sold)),
+                   then=Value(product_id))
+              for category_id, (product_id, units_sold) in products.items()],
+            default=F('top_product_id'), output_field=models.BigIntegerField())
+        return self.filter(pk__in=products).update(top_product_id=tops)
+
+    def rebuild_top_products(self):
+        best = Product.objects.filter(category=OuterRef('pk'), units_sold__gt=0).order_by('-units_sold', '-id')
+        return self.update(top_product=Subquery(best.values('id')[:1]))
+
+    def rebuild_product_counters(self):
+        counters = Product.objects.filter(category=OuterRef('pk')).order_by().values('category')
+        return self.update(
+            products_count=Coalesce(
+                Subquery(counters.annotate(c=Count('id')).values('c')), 0),
+            products_in_stock_count=Coalesce(
+                Subquery(counters.annotate(c=Count('id', filter=Q(inventory__gt=0))).values('c')), 0),
+        )
+
 
 class Category(models.Model):
     title = models.CharField(max_length=255)
     description = models.CharField(max_length=500, blank=True)
+    # best seller by Product.units_sold, maintained on order creation
     top_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+')
+    # maintained by store.signals.handlers, rebuild with `manage.py rebuild_category_counters`
+    products_count = models.PositiveIntegerField(default=0, editable=False)
+    products_in_stock_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.title
@@ -19,6 +82,51 @@ class Discount(models.Model):
     description = models.CharField(max_length=255)
 
 
+class ProductQuerySet(models.QuerySet):
+    def record_sales(self, quantities):
+        """Add `quantities` ({product_id: units}) to units_sold with a single UPDATE."""
+        if not quantities:
+            return 0
+        increments = Case(
+            *[When(pk=product_id, then=Value(units)) for product_id, units in quantities.items()],
+            default=Value(0), output_field=models.PositiveIntegerField())
+        return self.filter(pk__in=quantities).update(units_sold=F('units_sold') + increments)
+
+    def rebuild_units_sold(self):
+        sold = (OrderItem.objects.filter(product=OuterRef('pk')).exclude(order__status=Order.ORDER_STATUS_CANCELED)
+                .order_by().values('product').annotate(units=Sum('quantity')).values('units'))
+        return self.update(units_sold=Coalesce(Subquery(sold), 0))
+
+    def best_sellers(self):
+        # served by the (category, units_sold, id) index
+        return self.order_by('-units_sold', '-id')
+
+    def with_prices(self):
+        return self.annotate(
+            discounted_price=pricing.discounted_price_expression(),
+            price_after_tax=pricing.price_after_tax_expression(),
+        )
+
+    def refresh_best_discounts(self):
+        # prices are part of the product representation, like the comment counters
+        return self.update(best_discount=pricing.best_discount_expression(), datetime_modified=timezone.now())
+
+    def adjust_comment_counters(self, approved):
+        if not approved:
+            return 0
+        # the count is part of the product representation, see ProductSerializer
+        return self.update(
+            approved_comments_count=F('approved_comments_count') + approved, datetime_modified=timezone.now())
+
+    def rebuild_comment_counters(self):
+        counters = (Comment.objects.filter(product=OuterRef('pk')).approved()
+                    .order_by().values('product').annotate(c=Count('id')).values('c'))
+        counted = Coalesce(Subquery(counters), 0)
+        # only the drifted rows, their representation changes like in adjust_comment_counters
+        return self.exclude(approved_comments_count=counted).update(
+            approved_comments_count=counted, datetime_modified=timezone.now())
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     category = models.ForeignKey(
@@ -30,10 +138,64 @@ class Product(models.Model):
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_modified = models.DateTimeField(auto_now=True)
     discounts = models.ManyToManyField(Discount, blank=True)
+    # percentage of the best discount, maintained by store.signals.handlers, see store.pricing
+    best_discount = models.DecimalField(max_digits=5, decimal_places=2, default=0, editable=False)
+    # units ordered, maintained by store.signals.handlers, rebuild with `manage.py rebuild_top_products`
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    # maintained by store.signals.handlers, rebuild with `manage.py rebuild_comment_counters`
+    approved_comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination seeks, one per ProductViewSet.ordering_fields
+            models.Index(fields=['name', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            # best sellers of a category, see Category.top_product
+            models.Index(fields=['category', 'units_sold', 'id']),
+            # inventory ranges: the stock levels of store.stock, ProductFilter's inventory lt/gt
+            models.Index(fields=['inventory', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # category counters are adjusted in post_save, keep them in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class StockAlert(models.Model):
+    """A product's inventory crossing a stock level, written by store.stock."""
+    LEVEL_LOW = 'L'
+    LEVEL_MEDIUM = 'M'
+    LEVEL_HIGH = 'H'
+    LEVELS = [
+        (LEVEL_LOW, 'Low'),
+        (LEVEL_MEDIUM, 'Medium'),
+        (LEVEL_HIGH, 'High'),
+    ]
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='stock_alerts')
+    previous_level = models.CharField(max_length=1, choices=LEVELS)
+    level = models.CharField(max_length=1, choices=LEVELS)
+    inventory = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ProductSearchToken(models.Model):
+    # inverted index for ProductSearchFilter, maintained by store.search
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = [['token', 'product']]
+
 
 class Customer(models.Model):
     user = models.OneToOneField(
@@ -72,6 +234,28 @@ class Address(models.Model):
     street = models.CharField(max_length=255)
 
 
+class OrderQuerySet(models.QuerySet):
+    def summary(self):
+        """
+        Order counts by status and the lifetime spend (total of the paid orders)
+        in one aggregate query, OrderItem rows are summed by the database.
+        """
+        statuses = [status for status, _ in Order.ORDER_STATUS]
+        result = self.aggregate(
+            orders_count=Count('id', distinct=True),
+            lifetime_spend=Coalesce(
+                Sum(F('items__quantity') * F('items__unit_price'), filter=Q(status=Order.ORDER_STATUS_PAID),
+                    output_field=DecimalField(max_digits=20, decimal_places=2)),
+                0, output_field=DecimalField(max_digits=20, decimal_places=2)),
+            **{f'status_{status}': Count('id', filter=Q(status=status), distinct=True) for status in statuses},
+        )
+        return {
+            'orders_count': result['orders_count'],
+            'by_status': {status: result[f'status_{status}'] for status in statuses},
+            'lifetime_spend': result['lifetime_spend'],
+        }
+
+
 class Order(models.Model):
     ORDER_STATUS_PAID = 'p'
     ORDER_STATUS_UNPAID = 'u'
@@ -88,6 +272,21 @@ class Order(models.Model):
     status = models.CharField(
         max_length=1, choices=ORDER_STATUS, default=ORDER_STATUS_UNPAID)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # a customer's order history, newest first, id breaks the ties of the keyset pagination
+            models.Index(fields=['customer', 'datetime_created', 'id']),
+            # OrderAdmin's changelist ordering
+            models.Index(fields=['datetime_created', 'id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # the sales rollups follow status changes in post_save, keep them in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
@@ -101,6 +300,103 @@ class OrderItem(models.Model):
         unique_together = [['order', 'product']]
 
 
+class SalesDayQuerySet(models.QuerySet):
+    def add(self, day, totals):
+        """
+        Add `totals` ({key_id: (orders_count, units, revenue)}, negative to take
+        a canceled order out) to the rows of `day`, created as needed.
+        """
+        if not totals:
+            return 0
+        key = self.model.rollup_key
+        # in key order, concurrent checkouts lock the rows in the same order
+        self.bulk_create([self.model(day=day, **{key: key_id}) for key_id in sorted(totals)], ignore_conflicts=True)
+
+        def increments(index, output_field):
+            return Case(*[When(**{key: key_id}, then=Value(values[index])) for key_id, values in totals.items()],
+                        default=Value(0), output_field=output_field)
+
+        return self.filter(day=day, **{f'{key}__in': totals}).update(
+            orders_count=F('orders_count') + increments(0, models.IntegerField()),
+            units=F('units') + increments(1, models.IntegerField()),
+            revenue=F('revenue') + increments(2, self.model._meta.get_field('revenue')),
+        )
+
+
+class SalesDay(models.Model):
+    """Sales of a day, non canceled orders only, see store.analytics."""
+    day = models.DateField()
+    orders_count = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = SalesDayQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class ProductSalesDay(SalesDay):
+    rollup_key = 'product_id'
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        # day first, reports read date ranges across products
+        unique_together = [['day', 'product']]
+
+
+class CategorySalesDay(SalesDay):
+    rollup_key = 'category_id'
+
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = [['day', 'category']]
+
+
+class OutboxEventQuerySet(models.QuerySet):
+    def pending(self):
+        return self.filter(dispatched_at__isnull=True, failed_at__isnull=True)
+
+    def due(self, now=None):
+        # served by the (dispatched_at, failed_at, available_at) index
+        return self.pending().filter(available_at__lte=now or timezone.now()).order_by('available_at', 'id')
+
+    def dead(self):
+        return self.filter(failed_at__isnull=False)
+
+
+class OutboxEvent(models.Model):
+    """
+    A signal to deliver once the transaction that wrote it commits, see
+    store.outbox. Written in the same transaction as the change it reports,
+    so it exists if and only if the change was committed.
+    """
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # when the event may next be claimed: the end of a worker's lease or of a retry delay
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    # dead letter: the last attempt failed, the event is left for an operator to retry
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboxEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dispatched_at', 'failed_at', 'available_at']),
+        ]
+
+
+class CommentQuerySet(models.QuerySet):
+    def approved(self):
+        return self.filter(status=Comment.COMMENT_STATUS_APPROVED)
+
+
 class Comment(models.Model):
     COMMENT_STATUS_WAITING = 'w'
     COMMENT_STATUS_APPROVED = 'a'
@@ -119,15 +415,115 @@ class Comment(models.Model):
     status = models.CharField(
         max_length=2, choices=COMMENT_STATUS, default=COMMENT_STATUS_WAITING)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # CommentViewSet pages through the comments of a product with one status, newest first
+            models.Index(fields=['product', 'status', 'datetime_created']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # the product's comment counter is adjusted in post_save, keep it in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+def line_total(prefix=''):
+    return ExpressionWrapper(
+        F(f'{prefix}quantity') * pricing.discounted_price_expression(f'{prefix}product__'),
+        output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def cart_expiry_cutoff():
+    """Carts created before this are expired, see STORE_CART_TTL."""
+    return timezone.now() - getattr(settings, 'STORE_CART_TTL', timedelta(days=30))
+
+
+class CartQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(created_at__gte=cart_expiry_cutoff())
+
+    def expired(self, cutoff=None):
+        return self.filter(created_at__lt=cutoff or cart_expiry_cutoff())
+
+    def with_totals(self):
+        return self.annotate(
+            items_count=Count('items'),
+            quantity_total=Coalesce(Sum('items__quantity'), 0),
+            unit_price_total=Coalesce(
+                Sum(line_total('items__')), 0, output_field=DecimalField(max_digits=20, decimal_places=2)),
+        )
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # expired carts are hidden from the API and removed by `manage.py purge_carts`
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = CartQuerySet.as_manager()
 
 
 # carts/asdasdlkajsdlasldjpea
 
 
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(item_total=line_total())
+
+    def add_products(self, cart_id, quantities):
+        """
+        Add `quantities` ({product_id: quantity}) to the cart, incrementing the
+        lines that already exist. A single INSERT ... ON DUPLICATE KEY / ON CONFLICT
+        statement where the backend has one, so concurrent adds of the same product
+        never race into the unique constraint.
+        """
+        if not quantities:
+            return self.none()
+
+        connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            if connection.vendor in ('mysql', 'postgresql', 'sqlite'):
+                self._upsert(connection, cart_id, quantities)
+            else:
+                for product_id, quantity in quantities.items():
+                    self._increment_or_create(cart_id, product_id, quantity)
+
+        return self.filter(cart_id=cart_id, product_id__in=list(quantities))
+
+    def _upsert(self, connection, cart_id, quantities):
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        cart, product, quantity = (self.model._meta.get_field(name) for name in ('cart', 'product', 'quantity'))
+        cart_value = cart.get_db_prep_value(cart_id, connection)
+
+        rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        params = [value for product_id, count in quantities.items() for value in (cart_value, product_id, count)]
+        columns = ', '.join(quote(field.column) for field in (cart, product, quantity))
+        sql = f'INSERT INTO {table} ({columns}) VALUES {rows} '
+
+        column = quote(quantity.column)
+        if connection.vendor == 'mysql':
+            sql += f'ON DUPLICATE KEY UPDATE {column} = {column} + VALUES({column})'
+        else:
+            sql += (f'ON CONFLICT ({quote(cart.column)}, {quote(product.column)}) '
+                    f'DO UPDATE SET {column} = {table}.{column} + excluded.{column}')
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _increment_or_create(self, cart_id, product_id, quantity):
+        line = self.filter(cart_id=cart_id, product_id=product_id)
+        if line.update(quantity=F('quantity') + quantity):
+            return
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+        except IntegrityError:
+            # someone else created the line in between
+            line.update(quantity=F('quantity') + quantity)
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(
         Cart, on_delete=models.CASCADE, related_name='items')
@@ -135,6 +531,8 @@ class CartItem(models.Model):
         Product, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
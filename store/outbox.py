@@ -0,0 +1,129 @@
+"""
+Transactional outbox for the side effects of the store's changes.
+
+`publish` writes an OutboxEvent in the caller's transaction instead of sending
+a signal from the request: emails, ERP sync and the like stop adding to the
+request's latency, and no event is lost or sent for a rolled back change.
+`manage.py dispatch_outbox` claims the due events in batches and sends their
+signals on a thread or process pool.
+
+Delivery is at least once. A claimed event is leased for `LEASE` seconds, if
+the worker dies before marking it dispatched it is claimed again, and a
+receiver raising makes the whole event retried (every receiver again) after
+a growing delay, up to `MAX_ATTEMPTS`. Receivers must tolerate duplicates.
+
+An event whose last attempt failed is dead-lettered: `failed_at` is set and it
+is never claimed again. `manage.py dispatch_outbox` reports them, the admin
+lists them and retries the selected ones with `retry`.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, OutboxEvent
+from .signals import order_created
+
+# topic: (signal, keyword argument of the instance sent, its model)
+TOPICS = {
+    'order_created': (order_created, 'order', Order),
+}
+
+MAX_ERROR_LENGTH = 4000
+LEASE_EXPIRED = 'The lease of the last attempt expired before its outcome was recorded.'
+
+
+def get_setting(name, default):
+    return getattr(settings, 'STORE_OUTBOX', {}).get(name, default)
+
+
+def publish(topic, instance):
+    """Record `topic` for `instance`, in the current transaction."""
+    _, name, _ = TOPICS[topic]
+    return OutboxEvent.objects.create(topic=topic, payload={name: instance.pk})
+
+
+def claim(batch_size, lease=None, max_attempts=None):
+    """
+    Lease up to `batch_size` due events to the caller. Concurrent workers skip
+    each other's locked rows, so an event is claimed by one of them at a time.
+    Due events out of attempts, their last worker died, are dead-lettered.
+    """
+    lease = get_setting('LEASE', 60) if lease is None else lease
+    max_attempts = max_attempts or get_setting('MAX_ATTEMPTS', 10)
+    now = timezone.now()
+
+    with transaction.atomic():
+        rows = list(OutboxEvent.objects.due(now).select_for_update(skip_locked=True)
+                    .values_list('id', 'topic', 'payload', 'attempts')[:batch_size])
+        events = [event for event in rows if event[3] < max_attempts]
+        expired = [event[0] for event in rows if event[3] >= max_attempts]
+        if events:
+            OutboxEvent.objects.filter(id__in=[event[0] for event in events]).update(
+                available_at=now + timedelta(seconds=lease), attempts=F('attempts') + 1)
+        if expired:
+            OutboxEvent.objects.filter(id__in=expired).update(failed_at=now, last_error=LEASE_EXPIRED)
+    return [(event_id, topic, payload, attempts + 1) for event_id, topic, payload, attempts in events]
+
+
+def deliver(topic, payload):
+    """
+    Send the signal of one event. Runs on the worker pool: returns the
+    formatted error instead of raising, so it crosses process boundaries.
+    """
+    close_old_connections()
+    try:
+        signal, name, model = TOPICS[topic]
+        instance = model.objects.get(pk=payload[name])
+        signal.send(sender=model, **{name: instance})
+    except Exception:
+        return traceback.format_exc()[-MAX_ERROR_LENGTH:]
+    finally:
+        close_old_connections()
+    return None
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt, doubling from RETRY_DELAY up to MAX_RETRY_DELAY."""
+    return min(get_setting('RETRY_DELAY', 5) * 2 ** (attempts - 1), get_setting('MAX_RETRY_DELAY', 3600))
+
+
+def complete(dispatched, failed, max_attempts=None):
+    """
+    Record the outcome of a batch: `dispatched` event ids, `failed`
+    [(event id, attempts, error)] retried later, or dead-lettered after their
+    last attempt. Returns the number of events dead-lettered.
+    """
+    max_attempts = max_attempts or get_setting('MAX_ATTEMPTS', 10)
+    now = timezone.now()
+    dead = 0
+    with transaction.atomic():
+        if dispatched:
+            OutboxEvent.objects.filter(id__in=dispatched).update(dispatched_at=now, last_error='')
+        for event_id, attempts, error in failed:
+            if attempts >= max_attempts:
+                dead += OutboxEvent.objects.filter(id=event_id).update(failed_at=now, last_error=error)
+            else:
+                OutboxEvent.objects.filter(id=event_id).update(
+                    available_at=now + timedelta(seconds=retry_delay(attempts)), last_error=error)
+    return dead
+
+
+def retry(queryset):
+    """Give the dead-lettered events of `queryset` a fresh set of attempts, due now."""
+    return queryset.dead().update(failed_at=None, attempts=0, available_at=timezone.now())
+
+
+def purge(older_than, batch_size=1000):
+    """Delete the events dispatched before `older_than`, in short transactions."""
+    deleted = 0
+    while True:
+        ids = list(OutboxEvent.objects.filter(dispatched_at__lt=older_than)
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
@@ -1,5 +1,260 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
+
+
+def estimate_count(queryset):
+    """
+    Row count of an unfiltered queryset taken from the table statistics of the
+    database instead of a COUNT(*). Falls back to an exact count for filtered
+    querysets and for backends without cheap statistics.
+    """
+    if queryset.query.where:
+        return queryset.count()
+
+    rows = table_rows(queryset)
+    return queryset.count() if rows is None else rows
+
+
+def table_rows(queryset):
+    """Row count of the queryset's table from the database statistics, None when there are none."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def planned_rows(queryset):
+    """Rows the query planner expects `queryset` to return, None on backends without a usable EXPLAIN."""
+    connection = connections[queryset.db]
+    sql, params = queryset.order_by().query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [column[0].lower() for column in cursor.description]
+            # the first table of the plan drives the row estimate
+            row = dict(zip(columns, cursor.fetchone()))
+            if row.get('rows') is None:
+                return None
+            return int(row['rows'] * float(row.get('filtered') or 100) / 100)
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for large tables: counts exactly up to `exact_count_limit` rows
+    with a bounded COUNT, beyond that takes the table statistics (unfiltered)
+    or the planner's estimate (filtered) instead of counting every row.
+    """
+    exact_count_limit = 10_000
+
+    @cached_property
+    def count(self):
+        # only the primary key is selected, annotations for display are not computed
+        queryset = self.object_list.order_by().values('pk')
+        bounded = queryset[:self.exact_count_limit + 1].count()
+        if bounded <= self.exact_count_limit:
+            return bounded
+
+        estimate = planned_rows(queryset) if queryset.query.where else table_rows(queryset)
+        if estimate is None:
+            return queryset.count()
+        # statistics lag behind, never claim fewer rows than were just seen
+        return max(estimate, bounded)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on (ordering fields..., id) instead of using
+    OFFSET, so every page costs the same. The ordering is whatever the filter
+    backends put on the queryset, restricted to the view's `ordering_fields`
+    and the queryset's own annotations (e.g. `search_rank`).
+
+    The total count is only computed on request: `?count=exact` or `?count=estimate`.
+    """
+    page_size = 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    tie_breaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        return self.get_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.count = await self.aget_count(queryset, request)
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request, view)])
+
+    def get_page_queryset(self, queryset, request, view):
+        """The queryset of the requested page plus one row telling whether there is a next page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor['r'])
+
+        ordering = [self._invert(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self._seek(ordering, self.cursor['v']))
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.first, self.last = (results[0], results[-1]) if results else (None, None)
+        if not results and self.reverse:
+            # walked back past the first row, nothing before this page
+            self.has_previous = False
+        return results
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, queryset, view):
+        allowed = set(getattr(view, 'ordering_fields', None) or []) | set(queryset.query.annotations)
+        ordering = []
+        for field in queryset.query.order_by:
+            if not isinstance(field, str) or field.lstrip('-') not in allowed:
+                break
+            ordering.append(field)
+
+        descending = bool(ordering) and ordering[0].startswith('-')
+        ordering.append(f'-{self.tie_breaker}' if descending else self.tie_breaker)
+        return ordering
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode in ('true', 'exact'):
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    async def aget_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode in ('true', 'exact'):
+            return await queryset.acount()
+        if mode == 'estimate':
+            return await sync_to_async(estimate_count)(queryset)
+        return None
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first is None:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.first, reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        position = {
+            'o': self.ordering,
+            'v': [self._value(instance, field) for field in self.ordering],
+            'r': int(reverse),
+        }
+        token = b64encode(json.dumps(position, separators=(',', ':')).encode(), altchars=b'-_').decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+
+        try:
+            position = json.loads(b64decode(token.encode(), altchars=b'-_', validate=True))
+            valid = (position['o'] == self.ordering
+                     and len(position['v']) == len(self.ordering)
+                     and position['r'] in (0, 1))
+        except (BinasciiError, ValueError, TypeError, KeyError):
+            valid = False
+
+        if not valid:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _seek(self, ordering, values):
+        # (a, b, id) > (x, y, z)  ->  a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        clauses = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {ordering[i].lstrip('-'): values[i] for i in range(index)}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': values[index]}))
+        return reduce(or_, clauses)
+
+    def _invert(self, field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def _value(self, instance, field):
+        # model instances, or dict rows from store.compiled_serializers
+        name = field.lstrip('-')
+        value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+        return value if isinstance(value, (int, str)) else str(value)
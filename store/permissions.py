@@ -1,5 +1,11 @@
+import hmac
+
 from rest_framework import permissions
 
+from core.permissions import ahas_perms, has_perms
+
+from . import metrics as store_metrics
+
 
 # from rest_framework.permissions import SAFE_METHODS
 
@@ -15,14 +21,42 @@ class IsAdminOrReadOnly(permissions.BasePermission):
 
 class SendPrivateEmail(permissions.BasePermission):
     def has_permission(self, request, view):
-        return bool(request.user and request.user.has_perm('store.send_private_email'))
+        return has_perms(request.user, ['store.send_private_email'])
 
 
-import copy
+class MetricsAccess(permissions.BasePermission):
+    """Staff users, or the scraper presenting STORE_METRICS['TOKEN'] as a bearer token."""
+
+    def has_permission(self, request, view):
+        token = store_metrics.get_setting('TOKEN', None)
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return True
+        return bool(request.user and request.user.is_staff)
 
 
 class CustomDjangoModelPermissions(permissions.DjangoModelPermissions):
+    """
+    DjangoModelPermissions requiring the view permission for GET, checked
+    against the per-user permission sets cached by core.permissions.
+    """
+    perms_map = {
+        **permissions.DjangoModelPermissions.perms_map,
+        'GET': ['%(app_label)s.view_%(model_name)s'],
+    }
 
-    def __init__(self):
-        self.perms_map = copy.deepcopy(self.perms_map)
-        self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
+    def has_permission(self, request, view):
+        if not request.user or (not request.user.is_authenticated and self.authenticated_users_only):
+            return False
+        if getattr(view, '_ignore_model_permissions', False):
+            return True
+        perms = self.get_required_permissions(request.method, self._queryset(view).model)
+        return has_perms(request.user, perms)
+
+    async def ahas_permission(self, request, view):
+        # has_permission for store.async_views, a cold permission set is loaded with the async ORM
+        if not request.user or (not request.user.is_authenticated and self.authenticated_users_only):
+            return False
+        if getattr(view, '_ignore_model_permissions', False):
+            return True
+        perms = self.get_required_permissions(request.method, self._queryset(view).model)
+        return await ahas_perms(request.user, perms)
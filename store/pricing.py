@@ -0,0 +1,69 @@
+"""
+Product prices: base price, best applicable discount, tax.
+
+`Discount.discount` is a percentage. The best one of a product is kept in
+`Product.best_discount` (maintained by store.signals.handlers from Discount
+and Product.discounts changes), so the effective price is an expression over
+the product's own columns: the same numbers come out of a queryset annotation
+(`Product.objects.with_prices()`, cart totals) and of the Python functions
+below (checkout, instances without the annotation).
+
+Prices are decimals rounded half up to cents at each step, on the
+discounted price first and on the taxed price second.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import DecimalField, ExpressionWrapper, F, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest, Least, Round
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal(100)
+
+PRICE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+DISCOUNT_FIELD = DecimalField(max_digits=5, decimal_places=2)
+
+
+def tax_rate():
+    return getattr(settings, 'STORE_TAX_RATE', Decimal('0.09'))
+
+
+def quantize(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+# Python
+
+def discounted_price(unit_price, best_discount):
+    return quantize(unit_price * (HUNDRED - best_discount) * CENT)
+
+
+def price_after_tax(unit_price, best_discount):
+    return quantize(discounted_price(unit_price, best_discount) * (1 + tax_rate()))
+
+
+# SQL, `prefix` reaches the product from a related model, e.g. 'product__'
+
+def discounted_price_expression(prefix=''):
+    return Round(
+        ExpressionWrapper(
+            # times a cent rather than divided by a hundred, integer columns must not divide as integers
+            F(f'{prefix}unit_price') * (Value(HUNDRED) - F(f'{prefix}best_discount')) * Value(CENT),
+            output_field=PRICE_FIELD),
+        2, output_field=PRICE_FIELD)
+
+
+def price_after_tax_expression(prefix=''):
+    return Round(
+        ExpressionWrapper(discounted_price_expression(prefix) * Value(1 + tax_rate()), output_field=PRICE_FIELD),
+        2, output_field=PRICE_FIELD)
+
+
+def best_discount_expression():
+    """Best discount of the product in OuterRef('pk'), as a percentage clamped to 0..100."""
+    from .models import Product
+
+    best = (Product.discounts.through.objects.filter(product=OuterRef('pk'))
+            .order_by().values('product').annotate(best=Max('discount__discount')).values('best'))
+    percentage = Coalesce(Subquery(best, output_field=DISCOUNT_FIELD), Value(Decimal(0)), output_field=DISCOUNT_FIELD)
+    return Least(Greatest(percentage, Value(Decimal(0))), Value(HUNDRED), output_field=DISCOUNT_FIELD)
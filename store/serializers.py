@@ -1,20 +1,26 @@
-from decimal import Decimal
-from django.db import transaction
+from datetime import timedelta
+
+from django.db.models import Count
+from django.utils import timezone
 from django.utils.text import slugify
 from rest_framework import serializers
 
-from store.models import Category, Product, Comment, Order, OrderItem,  Cart, CartItem, Customer
+from store import pricing
+from store.checkout import place_order
+from store.models import Category, Product, Comment, Order, OrderItem,  Cart, CartItem, Customer, StockAlert
 
 
 class CategorySerializer(serializers.ModelSerializer):
     # count_category = serializers.SerializerMethodField()
 
     count_category = serializers.IntegerField(
-        source='products.count', read_only=True)
+        source='products_count', read_only=True)
+    count_in_stock = serializers.IntegerField(
+        source='products_in_stock_count', read_only=True)
 
     class Meta:
         model = Category
-        fields = ['id', 'title', 'description', 'count_category']
+        fields = ['id', 'title', 'description', 'count_category', 'count_in_stock']
 
     # def get_count_category(self, category: Category):
     #     return category.products.count()
@@ -25,16 +31,33 @@ class ProductSerializer(serializers.ModelSerializer):
     price = serializers.DecimalField(
         max_digits=6, decimal_places=2, source='unit_price')
 
+    discounted_price = serializers.SerializerMethodField()
     unit_price_after_tax = serializers.SerializerMethodField()
+    comments_count = serializers.IntegerField(source='approved_comments_count', read_only=True)
+
+    # columns read by the method fields, see store.compiled_serializers
+    method_columns = {
+        'discounted_price': ['discounted_price'],
+        'unit_price_after_tax': ['price_after_tax'],
+    }
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'price',
-                  'category', 'unit_price_after_tax', 'inventory', 'slug', 'description']
+                  'category', 'discounted_price', 'unit_price_after_tax', 'inventory', 'slug', 'description',
+                  'comments_count']
         read_only_fields = ['slug']  # Make slug read-only
 
+    def get_discounted_price(self, product: Product):
+        # annotated by Product.objects.with_prices()
+        if hasattr(product, 'discounted_price'):
+            return product.discounted_price
+        return pricing.discounted_price(product.unit_price, product.best_discount)
+
     def get_unit_price_after_tax(self, product: Product):
-        return round(product.unit_price * Decimal(1.09), 2)
+        if hasattr(product, 'price_after_tax'):
+            return product.price_after_tax
+        return pricing.price_after_tax(product.unit_price, product.best_discount)
 
     def validate(self, data):
         if len(data['name']) < 6:
@@ -54,6 +77,19 @@ class ProductSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ProductImportSerializer(ProductSerializer):
+    # plain ids, store.bulk checks categories and products once per batch
+    id = serializers.IntegerField(required=False)
+    category = serializers.IntegerField(source='category_id')
+
+
+class TopProductSerializer(ProductSerializer):
+    units_sold = serializers.IntegerField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['units_sold']
+
+
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
@@ -81,37 +117,73 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id', 'product', 'quantity']
 
+    def validate(self, data):
+        # adding to an expired cart would revive it
+        if not Cart.objects.active().filter(id=self.context['cart_pk']).exists():
+            raise serializers.ValidationError('There is no cart with this cart id')
+        return data
+
     def create(self, validated_data):
         cart_id = self.context['cart_pk']
 
         product = validated_data.get('product')
         quantity = validated_data.get('quantity')
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id, product_id=product.id)
-            cart_item.quantity += quantity
-            cart_item.save()
-        except CartItem.DoesNotExist:
-            cart_item = CartItem.objects.create(
-                cart_id=cart_id, **validated_data)
+        cart_item = CartItem.objects.add_products(cart_id, {product.id: quantity}).get()
 
         self.instance = cart_item
 
         return cart_item
 
 
+class BatchCartItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+
+class BatchAddCartItemSerializer(serializers.ListSerializer):
+    child = BatchCartItemSerializer()
+
+    def validate(self, items):
+        if not items:
+            raise serializers.ValidationError('Send at least one item')
+
+        cart_id = self.context['cart_pk']
+        if not Cart.objects.active().filter(id=cart_id).exists():
+            raise serializers.ValidationError('There is no cart with this cart id')
+
+        product_ids = {item['product'] for item in items}
+        found = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        if product_ids - found:
+            raise serializers.ValidationError(
+                f'Invalid products: {sorted(product_ids - found)}')
+        return items
+
+    def create(self, validated_data):
+        quantities = {}
+        for item in validated_data:
+            quantities[item['product']] = quantities.get(item['product'], 0) + item['quantity']
+
+        return list(CartItem.objects.add_products(self.context['cart_pk'], quantities).order_by('id'))
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product = CartProductSerializer(read_only=True)
 
     item_total = serializers.SerializerMethodField()
 
+    method_columns = {'item_total': ['item_total']}
+
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'item_total']
 
     def get_item_total(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        # annotated by CartItem.objects.with_totals()
+        if hasattr(cart_item, 'item_total'):
+            return cart_item.item_total
+        product = cart_item.product
+        return cart_item.quantity * pricing.discounted_price(product.unit_price, product.best_discount)
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -120,13 +192,27 @@ class CartSerializer(serializers.ModelSerializer):
 
     unit_price_total = serializers.SerializerMethodField()
 
+    method_columns = {'unit_price_total': ['unit_price_total']}
+    related_querysets = {'items': lambda: CartItem.objects.with_totals()}
+
     class Meta:
         model = Cart
         fields = ['id', 'items', 'unit_price_total']
         read_only_fields = ['id']
 
     def get_unit_price_total(self, cart: Cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+        # annotated by Cart.objects.with_totals()
+        if hasattr(cart, 'unit_price_total'):
+            return cart.unit_price_total
+        return sum([item.quantity * pricing.discounted_price(item.product.unit_price, item.product.best_discount)
+                    for item in cart.items.all()])
+
+
+class CartSummarySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    items_count = serializers.IntegerField()
+    quantity_total = serializers.IntegerField()
+    unit_price_total = serializers.DecimalField(max_digits=20, decimal_places=2)
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -183,6 +269,12 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ['customer', 'status', 'datetime_created', 'items']
 
 
+class OrderSummarySerializer(serializers.Serializer):
+    orders_count = serializers.IntegerField()
+    by_status = serializers.DictField(child=serializers.IntegerField())
+    lifetime_spend = serializers.DecimalField(max_digits=20, decimal_places=2)
+
+
 class OrderUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
@@ -193,54 +285,65 @@ class OrderCreateSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
+        items_count = Cart.objects.active().filter(id=cart_id).annotate(
+            items_count=Count('items')).values_list('items_count', flat=True).first()
 
-        # try:
-        #     if Cart.objects.prefetch_related('items').get(id=cart_id).items.count() == 0:
-        #         raise serializers.ValidationError(
-        #             'Your cart is empty. Please add some product to it first')
-        # except Cart.DoesNotExist:
-        #     raise serializers.ValidationError(
-        #         'There is no cart with this cart id')
-
-        if not Cart.objects.filter(id=cart_id).exists():
+        if items_count is None:
             raise serializers.ValidationError(
                 'There is no cart with this cart id')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if items_count == 0:
             raise serializers.ValidationError(
                 'Your cart is empty. Please add some product to it first')
         return cart_id
 
     def save(self, **kwargs):
+        # locks, checks and decrements inventory, see store.checkout
+        return place_order(self.validated_data['cart_id'], self.context['customer_id'])
 
-        with transaction.atomic():
 
-            cart_id = self.validated_data['cart_id']
-            user_id = self.context['user_id']
+class SalesReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    category = serializers.IntegerField(required=False, source='category_id')
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
 
-            customer = Customer.objects.get(user_id=user_id)
+    def validate(self, data):
+        # the last 30 days by default
+        data['end'] = data.get('end') or timezone.localdate()
+        data['start'] = data.get('start') or data['end'] - timedelta(days=29)
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('start is after end')
+        return data
 
-            # print(f'{cart_id=}  {customer.first_name=}')
 
-            order = Order()
-            order.customer = customer
-            order.save()
+class SalesSerializer(serializers.Serializer):
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
 
-            cart_items = CartItem.objects.select_related(
-                'product').filter(cart_id=cart_id)
 
-            order_items = [
-                OrderItem(
-                    order=order,
-                    product=cart_item.product,
-                    unit_price=cart_item.product.unit_price,
-                    quantity=cart_item.quantity,
+class DailySalesSerializer(SalesSerializer):
+    day = serializers.DateField()
 
 
-                ) for cart_item in cart_items
-            ]
+class CategorySalesSerializer(SalesSerializer):
+    category = serializers.IntegerField(source='category_id')
+    orders_count = serializers.IntegerField()
 
-            OrderItem.objects.bulk_create(order_items)
 
-            Cart.objects.get(id=cart_id).delete()
+class ProductSalesSerializer(SalesSerializer):
+    product = serializers.IntegerField(source='product_id')
+    orders_count = serializers.IntegerField()
 
-            return order
+
+class SalesReportSerializer(SalesSerializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    days = DailySalesSerializer(many=True)
+    categories = CategorySalesSerializer(many=True)
+    products = ProductSalesSerializer(many=True)
+
+
+class StockAlertSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockAlert
+        fields = ['id', 'product', 'previous_level', 'level', 'inventory', 'created_at']
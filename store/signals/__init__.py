@@ -1,5 +1,13 @@
 from django.dispatch import Signal
 
 
+# sent by store.checkout.place_order inside the order's transaction, for the data derived from orders
+order_placed = Signal()
+
+# side effects of a new order (emails, ERP sync), delivered at least once by
+# `manage.py dispatch_outbox` after the order commits, see store.outbox
 order_created = Signal()
 
+# sent once by store.admin_bulk after a set-based change bypassing save(),
+# with `pks` (the changed rows) and `fields` (the changed field names)
+bulk_changed = Signal()
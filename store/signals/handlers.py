@@ -1,11 +1,294 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.db import transaction
 from django.dispatch import receiver
+from django.utils import timezone
 
-from store.models import Customer
+from store import analytics, stock
+from store.admin_bulk import batches
+from store.caching import bump_version
+from store.models import Category, Comment, Customer, Discount, Order, OrderItem, Product
+from store.search import index_products
+from store.signals import bulk_changed, order_placed
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_profile(sender, instance, created, **kwargs):
     if created:
         Customer.objects.create(user=instance)
+
+
+def _record_sales(order, sign):
+    with transaction.atomic():
+        units = analytics.record_order(order, sign)
+        Product.objects.record_sales(units)
+
+        if sign < 0:
+            # the top products taken back may have been overtaken
+            Category.objects.filter(top_product__in=units).rebuild_top_products()
+            return
+
+        # the best seller of this order in each category, against the current top products
+        candidates = {}
+        for product_id, category_id, units_sold in (Product.objects.filter(pk__in=units)
+                                                    .values_list('id', 'category_id', 'units_sold')):
+            if category_id not in candidates or units_sold > candidates[category_id][1]:
+                candidates[category_id] = (product_id, units_sold)
+        Category.objects.promote_top_products(candidates)
+
+
+@receiver(order_placed)
+def record_sales(sender, order, **kwargs):
+    _record_sales(order, 1)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, raw, update_fields=None, **kwargs):
+    instance._previous_status = None
+    if raw or instance.pk is None or (update_fields is not None and 'status' not in update_fields):
+        return
+    # locked until the save commits, concurrent cancellations must not both take the order out
+    instance._previous_status = (Order.objects.select_for_update().filter(pk=instance.pk)
+                                 .values_list('status', flat=True).first())
+
+
+@receiver(post_save, sender=Order)
+def update_sales_on_status_change(sender, instance, created, raw, **kwargs):
+    previous = instance.__dict__.pop('_previous_status', None)
+    if raw or created or previous is None:
+        # new orders are counted on order_placed, once their items exist
+        return
+
+    was_sale, is_sale = analytics.counts_as_sale(previous), analytics.counts_as_sale(instance.status)
+    if was_sale != is_sale:
+        _record_sales(instance, 1 if is_sale else -1)
+
+
+@receiver(bulk_changed, sender=Order)
+def rebuild_sales_of_orders(sender, pks, fields, **kwargs):
+    if 'status' not in fields:
+        return
+
+    # the previous statuses are gone with the update, the days and products touched are recomputed
+    days, product_ids, category_ids = set(), set(), set()
+    for batch in batches(pks):
+        days.update(timezone.localdate(created) for created in
+                    Order.objects.filter(pk__in=batch).values_list('datetime_created', flat=True))
+        for product_id, category_id in (OrderItem.objects.filter(order_id__in=batch)
+                                        .values_list('product_id', 'product__category_id')):
+            product_ids.add(product_id)
+            category_ids.add(category_id)
+
+    for day in sorted(days):
+        analytics.rebuild_days(day, day)
+    with transaction.atomic():
+        for batch in batches(sorted(product_ids)):
+            Product.objects.filter(pk__in=batch).rebuild_units_sold()
+        Category.objects.filter(pk__in=category_ids).rebuild_top_products()
+
+
+def _touches_category_counters(update_fields):
+    return update_fields is None or bool({'category', 'category_id', 'inventory'} & set(update_fields))
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_counter_state(sender, instance, raw, update_fields=None, **kwargs):
+    instance._counter_state = None
+    if raw or instance.pk is None or not _touches_category_counters(update_fields):
+        return
+
+    previous = Product.objects.filter(pk=instance.pk).values('category_id', 'inventory').first()
+    if previous is not None:
+        instance._counter_state = (previous['category_id'], previous['inventory'])
+
+
+@receiver(post_save, sender=Product)
+def update_category_counters_on_save(sender, instance, created, raw, update_fields=None, **kwargs):
+    if raw or not _touches_category_counters(update_fields):
+        return
+
+    # also read by record_stock_crossing, reset by the next pre_save
+    previous = getattr(instance, '_counter_state', None)
+    category_id, in_stock = instance.category_id, instance.inventory > 0
+
+    if created or previous is None:
+        Category.objects.filter(pk=category_id).adjust_product_counters(1, int(in_stock))
+    elif previous[0] == category_id:
+        Category.objects.filter(pk=category_id).adjust_product_counters(
+            in_stock=int(in_stock) - int(previous[1] > 0))
+    else:
+        Category.objects.filter(pk=previous[0]).adjust_product_counters(-1, -int(previous[1] > 0))
+        Category.objects.filter(pk=category_id).adjust_product_counters(1, int(in_stock))
+
+
+@receiver(post_save, sender=Product)
+def record_stock_crossing(sender, instance, created, raw, **kwargs):
+    previous = getattr(instance, '_counter_state', None)
+    if raw or created or previous is None:
+        return
+    stock.record_crossings([(instance.pk, previous[1], instance.inventory)])
+
+
+@receiver(post_delete, sender=Product)
+def update_category_counters_on_delete(sender, instance, **kwargs):
+    Category.objects.filter(pk=instance.category_id).adjust_product_counters(
+        -1, -int(instance.inventory > 0))
+
+
+def _touches_comment_counters(update_fields):
+    return update_fields is None or bool({'product', 'product_id', 'status'} & set(update_fields))
+
+
+def _adjust_comment_counters(product_id, approved):
+    if Product.objects.filter(pk=product_id).adjust_comment_counters(approved):
+        bump_version(Product)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_counter_state(sender, instance, raw, update_fields=None, **kwargs):
+    instance._counter_state = None
+    if raw or instance.pk is None or not _touches_comment_counters(update_fields):
+        return
+
+    previous = Comment.objects.filter(pk=instance.pk).values('product_id', 'status').first()
+    if previous is not None:
+        instance._counter_state = (previous['product_id'], previous['status'] == Comment.COMMENT_STATUS_APPROVED)
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_counters_on_save(sender, instance, created, raw, update_fields=None, **kwargs):
+    if raw or not _touches_comment_counters(update_fields):
+        return
+
+    previous = instance.__dict__.pop('_counter_state', None)
+    approved = instance.status == Comment.COMMENT_STATUS_APPROVED
+
+    if created or previous is None:
+        _adjust_comment_counters(instance.product_id, int(approved))
+    elif previous[0] == instance.product_id:
+        _adjust_comment_counters(instance.product_id, int(approved) - int(previous[1]))
+    else:
+        _adjust_comment_counters(previous[0], -int(previous[1]))
+        _adjust_comment_counters(instance.product_id, int(approved))
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_counters_on_delete(sender, instance, origin=None, **kwargs):
+    if getattr(origin, 'model', type(origin)) is Product:
+        # cascaded from deleting the product itself
+        return
+    _adjust_comment_counters(instance.product_id, -int(instance.status == Comment.COMMENT_STATUS_APPROVED))
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_index(sender, instance, raw, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is None or {'name', 'description', 'category', 'category_id'} & set(update_fields):
+        index_products(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_title(sender, instance, raw, **kwargs):
+    instance._previous_title = None
+    if not raw and instance.pk is not None:
+        instance._previous_title = Category.objects.filter(pk=instance.pk).values_list('title', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+def update_category_search_index(sender, instance, created, raw, **kwargs):
+    previous_title = instance.__dict__.pop('_previous_title', None)
+    if raw or created or previous_title == instance.title:
+        return
+    index_products(Product.objects.filter(category_id=instance.pk))
+
+
+@receiver(bulk_changed, sender=Product)
+def refresh_product_derived_data(sender, pks, fields, **kwargs):
+    if {'category', 'category_id'} & fields:
+        # the previous categories are gone with the update
+        Category.objects.rebuild_product_counters()
+    elif 'inventory' in fields:
+        category_ids = set()
+        for batch in batches(pks):
+            category_ids.update(Product.objects.filter(pk__in=batch).values_list('category_id', flat=True))
+        Category.objects.filter(pk__in=category_ids).rebuild_product_counters()
+
+    if {'name', 'description', 'category', 'category_id'} & fields:
+        for batch in batches(pks):
+            index_products(Product.objects.filter(pk__in=batch))
+
+
+@receiver(bulk_changed, sender=Comment)
+def refresh_comment_counters(sender, pks, fields, **kwargs):
+    if not {'status', 'product', 'product_id'} & fields:
+        return
+
+    if {'product', 'product_id'} & fields:
+        # the previous products are gone with the update
+        product_batches = [Product.objects.all()]
+    else:
+        product_ids = set()
+        for batch in batches(pks):
+            product_ids.update(Comment.objects.filter(pk__in=batch).values_list('product_id', flat=True))
+        product_batches = (Product.objects.filter(pk__in=batch) for batch in batches(sorted(product_ids)))
+
+    # the count is part of the product representation, see ProductQuerySet.adjust_comment_counters
+    now = timezone.now()
+    for products in product_batches:
+        products.rebuild_comment_counters()
+        products.update(datetime_modified=now)
+    bump_version(Product)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(bulk_changed, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(bulk_changed, sender=Category)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def bump_catalog_version(sender, **kwargs):
+    bump_version(sender)
+
+
+def _refresh_best_discounts(product_ids):
+    for batch in batches(sorted(product_ids)):
+        Product.objects.filter(pk__in=batch).refresh_best_discounts()
+    bump_version(Product)
+
+
+@receiver(post_save, sender=Discount)
+def refresh_prices_on_discount_save(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    _refresh_best_discounts(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Discount)
+def remember_discounted_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Discount)
+def refresh_prices_on_discount_delete(sender, instance, **kwargs):
+    _refresh_best_discounts(instance.__dict__.pop('_product_ids', []))
+
+
+@receiver(m2m_changed, sender=Product.discounts.through)
+def refresh_prices_on_discount_links(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # discount.product_set.clear(), the links are gone once it is done
+        instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = instance.__dict__.pop('_product_ids', [])
+    else:
+        product_ids = pk_set
+    _refresh_best_discounts(product_ids)
@@ -0,0 +1,136 @@
+"""
+Stock levels and the alerts raised when a product's inventory crosses them.
+
+Inventory below STORE_STOCK['LOW'] is Low, from STORE_STOCK['HIGH'] on High,
+Medium in between. Every write path changing inventory (Product.save through
+store.signals.handlers, checkout, bulk import, the admin's actions) passes the
+previous and new quantities to `record_crossings` in its own transaction, so a
+StockAlert exists for every committed crossing and for no other.
+
+`alert_events` turns the alerts into Server-Sent Events for the
+`/store/stock-alerts/` stream. It is an async generator: served over ASGI a
+stream holds no worker thread while it waits, only a coroutine polling the
+alerts above its position, a range read on the primary key, every
+STORE_STOCK['POLL_INTERVAL'] seconds. Polling the table rather than a cache
+version keeps every process in sync whatever the cache backend.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.renderers import JSONRenderer
+
+from .models import StockAlert
+
+# an alert id missing below a sent one is waited for this long: ids are
+# allocated at insert and the transactions writing them commit in any order
+GAP_TIMEOUT = 30
+HEARTBEAT_INTERVAL = 15
+# milliseconds the client waits before reconnecting once a stream ends
+RETRY = 1000
+FETCH_SIZE = 500
+
+
+def get_setting(name, default):
+    return getattr(settings, 'STORE_STOCK', {}).get(name, default)
+
+
+def stock_level(inventory):
+    if inventory < get_setting('LOW', 3):
+        return StockAlert.LEVEL_LOW
+    if inventory >= get_setting('HIGH', 17):
+        return StockAlert.LEVEL_HIGH
+    return StockAlert.LEVEL_MEDIUM
+
+
+def level_filter(level):
+    """The products at `level`, a range on the (inventory, id) index."""
+    low, high = get_setting('LOW', 3), get_setting('HIGH', 17)
+    if level == StockAlert.LEVEL_LOW:
+        return Q(inventory__lt=low)
+    if level == StockAlert.LEVEL_HIGH:
+        return Q(inventory__gte=high)
+    return Q(inventory__gte=low, inventory__lt=high)
+
+
+def record_crossings(changes):
+    """
+    Write a StockAlert for each of `changes` ([(product_id, previous
+    inventory, inventory)]) moving the product to another level.
+    """
+    alerts = []
+    for product_id, previous, inventory in changes:
+        previous_level, level = stock_level(previous), stock_level(inventory)
+        if previous_level != level:
+            alerts.append(StockAlert(
+                product_id=product_id, previous_level=previous_level, level=level, inventory=inventory))
+    if alerts:
+        StockAlert.objects.bulk_create(alerts)
+    return alerts
+
+
+class AlertCursor:
+    """
+    Position of a stream in the alerts. `position` is the resume point: every
+    alert up to it was sent, or missing for GAP_TIMEOUT. Alerts above it may
+    have been sent already and are sent again to a client resuming from it.
+    """
+
+    def __init__(self, position):
+        self.position = position
+        # sent above the position: id -> when it was sent
+        self.sent = {}
+
+    async def fetch(self):
+        alerts = [alert async for alert in StockAlert.objects.filter(id__gt=self.position)
+                  .exclude(id__in=list(self.sent)).order_by('id')[:FETCH_SIZE]]
+        now = time.monotonic()
+        for alert in alerts:
+            self.sent[alert.id] = now
+        self.advance(now)
+        return alerts
+
+    def advance(self, now):
+        for alert_id in sorted(self.sent):
+            if alert_id != self.position + 1 and now - self.sent[alert_id] < GAP_TIMEOUT:
+                break
+            self.position = alert_id
+            del self.sent[alert_id]
+
+
+def latest_alert_id():
+    return StockAlert.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+async def alert_events(after, serializer_class):
+    """
+    Yield the alerts after id `after` as Server-Sent Events until
+    STORE_STOCK['STREAM_TIMEOUT'], polling at least once. The event ids are the
+    cursor's resume point, delivery is at least once: clients recognise
+    repeated alerts by their `id`.
+    """
+    cursor = AlertCursor(after)
+    deadline = time.monotonic() + get_setting('STREAM_TIMEOUT', 30)
+    poll_interval = get_setting('POLL_INTERVAL', 1)
+    renderer = JSONRenderer()
+    last_write = time.monotonic()
+
+    yield f'retry: {RETRY}\n\n'
+    while True:
+        alerts = await cursor.fetch()
+        for alert in alerts:
+            data = renderer.render(serializer_class(alert).data).decode()
+            # the alerts of the batch after this one are not sent yet
+            yield f'id: {min(cursor.position, alert.id)}\nevent: stock\ndata: {data}\n\n'
+            last_write = time.monotonic()
+
+        if time.monotonic() >= deadline:
+            return
+        if time.monotonic() - last_write >= HEARTBEAT_INTERVAL:
+            # keeps proxies from closing an idle connection
+            yield ': keepalive\n\n'
+            last_write = time.monotonic()
+        # after a full batch more alerts may be waiting
+        if len(alerts) < FETCH_SIZE:
+            await asyncio.sleep(poll_interval)
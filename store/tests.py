@@ -1,3 +1,713 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from core.models import CustomUser
+
+from . import metrics, outbox, pricing, stock
+from .benchmarks import measure
+from .checkout import place_order
+from .compiled_serializers import compile_serializer
+from .models import Cart, CartItem, Category, CategorySalesDay, Comment, Customer, Discount, Order, OutboxEvent, \
+    Product, ProductSalesDay, StockAlert
+from .paginations import EstimatedCountPaginator, estimate_count
+from .search import tokenize
+from .serializers import ProductSerializer
+
+# the suite runs without a cache server, none of these tests needs a shared cache
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StoreTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_authenticate(self.admin)
+        self.category = Category.objects.create(title='Computers')
+
+    def create_product(self, name='Product', inventory=10, unit_price=10, category=None, description='desc'):
+        return Product.objects.create(name=name, category=category or self.category, slug='slug',
+                                      description=description, unit_price=unit_price, inventory=inventory)
+
+    def create_customer(self, username='customer'):
+        user = CustomUser.objects.create_user(username, f'{username}@example.com', 'pw')
+        return Customer.objects.get(user=user)
+
+    def fill_cart(self, *lines):
+        cart = Cart.objects.create()
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def order(self, customer, *lines):
+        return place_order(self.fill_cart(*lines).pk, customer.pk)
+
+
+class CategoryCountersTests(StoreTestCase):
+    def counters(self):
+        return Category.objects.values_list('products_count', 'products_in_stock_count').get(pk=self.category.pk)
+
+    def test_counters_follow_product_writes(self):
+        product = self.create_product(inventory=5)
+        self.create_product(inventory=0)
+        self.assertEqual(self.counters(), (2, 1))
+
+        product.inventory = 0
+        product.save()
+        self.assertEqual(self.counters(), (2, 0))
+
+        other = Category.objects.create(title='Other')
+        product.category = other
+        product.inventory = 3
+        product.save()
+        self.assertEqual(self.counters(), (1, 0))
+        self.assertEqual(Category.objects.values_list('products_count', 'products_in_stock_count').get(pk=other.pk),
+                         (1, 1))
+
+        product.delete()
+        self.assertEqual(Category.objects.values_list('products_count', 'products_in_stock_count').get(pk=other.pk),
+                         (0, 0))
+
+    def test_rebuild_category_counters(self):
+        self.create_product(inventory=5)
+        Category.objects.update(products_count=10, products_in_stock_count=10)
+        call_command('rebuild_category_counters', stdout=StringIO())
+        self.assertEqual(self.counters(), (1, 1))
+
+    def test_list_costs_one_query(self):
+        for index in range(5):
+            Category.objects.create(title=f'Category {index}')
+            self.create_product(inventory=index)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/store/categories/')
+        self.assertEqual(response.status_code, 200)
+        counters = {row['title']: (row['count_category'], row['count_in_stock']) for row in response.json()}
+        self.assertEqual(counters['Computers'], (5, 4))
+
+
+class KeysetPaginationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(25):
+            self.create_product(name=f'Product {index:02d}', unit_price=index % 4 + 1)
+
+    def walk(self, url):
+        names, pages = [], 0
+        while url:
+            data = self.client.get(url).json()
+            names += [row['title'] for row in data['results']]
+            url = data['next']
+            pages += 1
+        return names, pages
+
+    def test_pages_cover_every_product_once(self):
+        names, pages = self.walk('/store/products/?ordering=name')
+        self.assertEqual(pages, 3)
+        self.assertEqual(names, sorted(Product.objects.values_list('name', flat=True)))
+
+    def test_pages_on_ties_of_a_descending_ordering(self):
+        names, _ = self.walk('/store/products/?ordering=-unit_price&page_size=7')
+        expected = list(Product.objects.order_by('-unit_price', '-id').values_list('name', flat=True))
+        self.assertEqual(names, expected)
+
+    def test_previous_link_returns_the_first_page(self):
+        first = self.client.get('/store/products/?ordering=name').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/store/products/?cursor=garbage').status_code, 404)
+
+    def test_count_on_request(self):
+        self.assertNotIn('count', self.client.get('/store/products/').json())
+        self.assertEqual(self.client.get('/store/products/?count=exact').json()['count'], 25)
+
+
+class SearchTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_product(name='Gaming laptop')
+        self.create_product(name='Lap desk')
+        self.create_product(name='Desktop tower')
+
+    def search(self, query):
+        return [row['title'] for row in self.client.get('/store/products/', {'search': query}).json()['results']]
+
+    def test_whole_words_rank_above_prefixes(self):
+        self.assertEqual(self.search('lap'), ['Lap desk', 'Gaming laptop'])
+
+    def test_no_infix_matches(self):
+        self.assertEqual(self.search('top'), [])
+
+    def test_index_follows_renames_and_category_titles(self):
+        product = Product.objects.get(name='Lap desk')
+        product.name = 'Standing desk'
+        product.save()
+        self.assertEqual(self.search('lap'), ['Gaming laptop'])
+
+        self.category.title = 'Furniture'
+        self.category.save()
+        self.assertEqual(len(self.search('furniture')), 3)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Gaming, LAPTOP!'), ['gaming', 'laptop'])
+
+
+class ResponseCacheTests(StoreTestCase):
+    def test_category_list_cached_until_a_product_changes(self):
+        product = self.create_product(inventory=5)
+        self.assertEqual(self.client.get('/store/categories/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/store/categories/')['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.inventory = 0
+            product.save()
+        response = self.client.get('/store/categories/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['count_in_stock'], 0)
+
+    def test_product_detail_cached_until_it_changes(self):
+        product = self.create_product(name='Old name')
+        url = f'/store/products/{product.pk}/'
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'title': 'New name'})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['title'], 'New name')
+
+    def test_permissions_checked_on_hits(self):
+        self.client.get('/store/products/')
+        self.assertEqual(APIClient().get('/store/products/').status_code, 401)
+
+
+class CartTestCase(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.keyboard = self.create_product(name='Keyboard', unit_price='12.50')
+        self.mouse = self.create_product(name='Mouse', unit_price=4)
+        self.cart_id = self.client.post('/store/carts/').json()['id']
+        self.items_url = f'/store/carts/{self.cart_id}/items/'
+
+
+class CartTotalsTests(CartTestCase):
+    def test_totals_computed_in_the_database(self):
+        Discount.objects.create(discount=10, description='sale').product_set.add(self.keyboard)
+        self.client.post(self.items_url, {'product': self.keyboard.pk, 'quantity': 2})
+        self.client.post(self.items_url, {'product': self.mouse.pk, 'quantity': 3})
+
+        cart = self.client.get(f'/store/carts/{self.cart_id}/').json()
+        self.assertEqual(Decimal(str(cart['unit_price_total'])), Decimal('34.50'))
+        summary = self.client.get(f'/store/carts/{self.cart_id}/summary/').json()
+        self.assertEqual((summary['items_count'], summary['quantity_total']), (2, 5))
+
+
+class CartItemUpsertTests(CartTestCase):
+    def test_adding_a_product_twice_adds_up_one_line(self):
+        self.client.post(self.items_url, {'product': self.keyboard.pk, 'quantity': 2})
+        self.client.post(self.items_url, {'product': self.keyboard.pk, 'quantity': 3})
+        self.assertEqual(list(CartItem.objects.filter(cart_id=self.cart_id).values_list('quantity', flat=True)), [5])
+
+    def test_batch_add(self):
+        response = self.client.post(f'{self.items_url}batch/', [
+            {'product': self.keyboard.pk, 'quantity': 1},
+            {'product': self.mouse.pk, 'quantity': 2},
+        ], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.post(f'{self.items_url}batch/', [{'product': self.mouse.pk, 'quantity': 1}], format='json')
+        self.assertEqual(dict(CartItem.objects.filter(cart_id=self.cart_id).values_list('product_id', 'quantity')),
+                         {self.keyboard.pk: 1, self.mouse.pk: 3})
+
+    def test_batch_rejects_unknown_products(self):
+        response = self.client.post(f'{self.items_url}batch/', [{'product': 0, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CheckoutTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.create_customer()
+        self.client.force_authenticate(self.customer.user)
+
+    def test_order_takes_the_inventory_and_empties_the_cart(self):
+        product = self.create_product(inventory=5)
+        cart = self.fill_cart((product, 2))
+
+        response = self.client.post('/store/orders/', {'cart_id': str(cart.pk)})
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        self.assertEqual((product.inventory, product.units_sold), (3, 2))
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_rejects_orders_short_on_stock(self):
+        product = self.create_product(name='Scarce product', inventory=1)
+        cart = self.fill_cart((product, 2))
+
+        response = self.client.post('/store/orders/', {'cart_id': str(cart.pk)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Scarce product', str(response.json()))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=product.pk).inventory, 1)
+
+    def test_sold_out_products_leave_the_in_stock_counter(self):
+        product = self.create_product(inventory=2)
+        self.order(self.customer, (product, 2))
+        self.assertEqual(Category.objects.get(pk=self.category.pk).products_in_stock_count, 0)
+
+    def test_fixed_statement_count_whatever_the_categories(self):
+        products = [self.create_product(category=Category.objects.create(title=f'Category {index}'))
+                    for index in range(4)]
+        carts = [self.fill_cart((products[0], 1)).pk, self.fill_cart(*[(product, 1) for product in products]).pk]
+
+        for cart_id in carts:
+            with self.assertNumQueries(22):
+                place_order(cart_id, self.customer.pk)
+
+
+class BulkImportExportTests(StoreTestCase):
+    def test_export_csv(self):
+        self.create_product(name='Keyboard')
+        response = self.client.get('/store/products/bulk/', {'type': 'csv'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(len(rows), 2)
+        self.assertIn('Keyboard', rows[1])
+
+    def test_import_ndjson(self):
+        product = self.create_product(name='Keyboard')
+        lines = [
+            {'id': product.pk, 'title': 'Mechanical keyboard', 'price': 30, 'category': self.category.pk,
+             'inventory': 4, 'description': 'desc'},
+            {'title': 'Wireless mouse', 'price': 15, 'category': self.category.pk, 'inventory': 7,
+             'description': 'desc'},
+        ]
+        response = self.client.generic('POST', '/store/products/bulk/', '\n'.join(json.dumps(line) for line in lines),
+                                       content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Product.objects.get(pk=product.pk).name, 'Mechanical keyboard')
+        self.assertEqual(Category.objects.get(pk=self.category.pk).products_count, 2)
+
+    def test_import_rejects_repeated_ids(self):
+        product = self.create_product(name='Keyboard')
+        line = {'id': product.pk, 'title': 'Mechanical keyboard', 'price': 30, 'category': self.category.pk,
+                'inventory': 4, 'description': 'desc'}
+        response = self.client.generic('POST', '/store/products/bulk/', f'{json.dumps(line)}\n{json.dumps(line)}',
+                                       content_type='application/x-ndjson')
+        self.assertIn('Duplicate pk - already updated by line 1.', json.dumps(response.json()))
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.create_customer().user)
+        self.assertEqual(self.client.get('/store/products/bulk/').status_code, 403)
+
+
+class MetricsTests(StoreTestCase):
+    def test_staff_only(self):
+        self.client.get('/store/categories/')
+        response = self.client.get('/store/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('store_request_duration_seconds', response.content.decode())
+        self.assertEqual(APIClient().get('/store/metrics/').status_code, 401)
+
+    @override_settings(STORE_METRICS={'ENABLED': True, 'TOKEN': 'secret'})
+    def test_bearer_token(self):
+        client = APIClient()
+        self.assertEqual(client.get('/store/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.assertIn(client.get('/store/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, (401, 403))
+
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(metrics.fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a'"),
+                         metrics.fingerprint("SELECT * FROM t WHERE id IN (4) AND name = 'b'"))
+
+    @override_settings(STORE_METRICS={'ENABLED': True, 'WORST_QUERIES': 2})
+    def test_only_the_worst_queries_are_fingerprinted(self):
+        self.addCleanup(metrics.reset)
+        route = ('view', 'route', 'GET')
+        with mock.patch.object(metrics, 'fingerprint', wraps=metrics.fingerprint) as fingerprint:
+            metrics.record(*route, 0.5, [('SELECT 1', 0.3), ('SELECT 2', 0.1), ('SELECT 3', 0.2)], None)
+            metrics.record(*route, 0.5, [('SELECT 4', 0.05), ('SELECT 5', 0.25)], None)
+
+        self.assertEqual(fingerprint.call_count, 3)
+        self.assertEqual(sorted(seconds for seconds, _ in metrics._routes[route].worst_queries), [0.25, 0.3])
+
+
+class BenchmarkTests(TestCase):
+    def test_measure_passes_the_setup_result(self):
+        calls = []
+        timings = measure(calls.append, 3, setup=lambda: len(calls))
+        self.assertEqual(len(timings), 3)
+        self.assertEqual(calls, [0, 1, 2])
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_bench_api_requires_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'The default cache is per process'):
+            call_command('bench_api', stdout=StringIO())
+
+
+class ConditionalGetTests(StoreTestCase):
+    def test_list_etag(self):
+        product = self.create_product()
+        etag = self.client.get('/store/products/')['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.client.get('/store/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_etag_follows_datetime_modified(self):
+        product = self.create_product()
+        url = f'/store/products/{product.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Product.objects.filter(pk=product.pk).update(datetime_modified=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_costs_one_query(self):
+        for index in range(15):
+            self.create_product(name=f'Product {index}')
+        self.client.get('/store/products/')
+
+        # another ordering, not cached yet
+        with self.assertNumQueries(1):
+            response = self.client.get('/store/products/?ordering=-price')
+        self.assertEqual(len(response.json()['results']), 10)
+
+
+class CompiledSerializerTests(StoreTestCase):
+    def test_same_output_as_the_serializer(self):
+        Discount.objects.create(discount=15, description='sale').product_set.add(self.create_product())
+        self.create_product(name='Mouse', unit_price='3.33')
+
+        compiled = compile_serializer(ProductSerializer)
+        queryset = Product.objects.with_prices().order_by('id')
+        self.assertEqual(json.loads(json.dumps(compiled.serialize(compiled.values(queryset)), default=str)),
+                         json.loads(json.dumps(ProductSerializer(queryset, many=True).data, default=str)))
+
+
+class AsyncReadTests(StoreTestCase):
+    def test_read_actions_are_coroutines(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/store/products/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/store/categories/').func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/store/products/bulk/').func))
+
+    def test_json_and_browsable_responses(self):
+        self.create_product()
+        self.assertEqual(len(self.client.get('/store/products/', HTTP_ACCEPT='application/json').json()['results']), 1)
+        # the browsable API is handed to the sync view
+        self.assertEqual(self.client.get('/store/products/', HTTP_ACCEPT='text/html').status_code, 200)
+
+    def test_cache_reads_stay_off_the_event_loop(self):
+        self.create_product()
+        self.client.get('/store/categories/')
+        with mock.patch.object(cache, 'get_many', side_effect=AssertionError('sync call')), \
+                mock.patch.object(cache, 'aget', wraps=cache.aget) as aget:
+            response = self.client.get('/store/categories/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertTrue(aget.called)
+
+
+class OrderHistoryTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.create_customer()
+        self.product = self.create_product(inventory=100)
+        for quantity in range(1, 13):
+            self.order(self.customer, (self.product, quantity))
+        self.order(self.create_customer('other'), (self.product, 1))
+        self.client.force_authenticate(self.customer.user)
+
+    def test_history_paginated_newest_first(self):
+        first = self.client.get('/store/orders/').json()
+        second = self.client.get(first['next']).json()
+        quantities = [row['items'][0]['quantity'] for row in first['results'] + second['results']]
+        self.assertEqual(quantities, list(range(12, 0, -1)))
+        self.assertIsNone(second['next'])
+
+    def test_summary(self):
+        summary = self.client.get('/store/orders/summary/').json()
+        self.assertEqual(summary['orders_count'], 12)
+
+
+class CommentTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.create_product()
+        self.url = f'/store/products/{self.product.pk}/comments/'
+
+    def count(self):
+        return Product.objects.get(pk=self.product.pk).approved_comments_count
+
+    def test_counter_follows_moderation(self):
+        comment = Comment.objects.create(product=self.product, name='n', body='b')
+        self.assertEqual(self.count(), 0)
+        comment.status = Comment.COMMENT_STATUS_APPROVED
+        comment.save()
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(self.client.get(f'/store/products/{self.product.pk}/').json()['comments_count'], 1)
+        comment.delete()
+        self.assertEqual(self.count(), 0)
+
+    def test_rebuild_touches_the_drifted_products(self):
+        other = self.create_product()
+        Comment.objects.create(product=self.product, name='n', body='b', status=Comment.COMMENT_STATUS_APPROVED)
+        stamp = timezone.now() - timedelta(days=1)
+        Product.objects.update(datetime_modified=stamp)
+        Product.objects.filter(pk=self.product.pk).update(approved_comments_count=5)
+
+        out = StringIO()
+        call_command('rebuild_comment_counters', stdout=out)
+        self.assertIn('1 products rebuilt.', out.getvalue())
+        self.assertEqual(self.count(), 1)
+        self.assertGreater(Product.objects.get(pk=self.product.pk).datetime_modified, stamp)
+        self.assertEqual(Product.objects.get(pk=other.pk).datetime_modified, stamp)
+
+    def test_listing_shows_approved_comments(self):
+        for index in range(12):
+            Comment.objects.create(product=self.product, name='n', body=f'approved {index}',
+                                   status=Comment.COMMENT_STATUS_APPROVED)
+        Comment.objects.create(product=self.product, name='n', body='waiting')
+
+        client = APIClient()
+        first = client.get(self.url).json()
+        second = client.get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 12)
+        self.assertEqual(len(client.get(self.url, {'status': 'w'}).json()['results']), 10)
+        self.assertEqual([row['body'] for row in self.client.get(self.url, {'status': 'w'}).json()['results']],
+                         ['waiting'])
+
+
+class CartExpiryTests(CartTestCase):
+    def test_expired_carts_are_hidden_and_purged(self):
+        Cart.objects.filter(pk=self.cart_id).update(created_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(self.client.get(f'/store/carts/{self.cart_id}/').status_code, 404)
+        self.assertEqual(self.client.get(self.items_url).json(), [])
+
+        active = Cart.objects.create()
+        call_command('purge_carts', stdout=StringIO())
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [active.pk])
+
+
+class AdminActionTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def test_clear_inventory(self):
+        products = [self.create_product(inventory=inventory) for inventory in (0, 5, 20)]
+
+        response = self.client.post('/admin/store/product/', {
+            'action': 'clear_inventory', '_selected_action': [product.pk for product in products]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Product.objects.values_list('inventory', flat=True).distinct()), [0])
+        self.assertEqual(Category.objects.get(pk=self.category.pk).products_in_stock_count, 0)
+
+    def test_make_waiting(self):
+        product = self.create_product()
+        comment = Comment.objects.create(product=product, name='n', body='b', status=Comment.COMMENT_STATUS_APPROVED)
+        self.client.post('/admin/store/comment/', {'action': 'make_wa', '_selected_action': [comment.pk]})
+        self.assertEqual(Product.objects.get(pk=product.pk).approved_comments_count, 0)
+
+    def test_customer_first_name_case(self):
+        customer = self.create_customer()
+        CustomUser.objects.filter(pk=customer.user_id).update(first_name='Ada')
+        self.client.post('/admin/store/customer/', {'action': 'uppercase', '_selected_action': [customer.pk]})
+        self.assertEqual(CustomUser.objects.get(pk=customer.user_id).first_name, 'ADA')
+
+
+class EstimatedCountTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        for index in range(5):
+            self.create_product(name=f'Product {index}', inventory=index)
+
+    def test_exact_up_to_the_limit(self):
+        paginator = EstimatedCountPaginator(Product.objects.order_by('id'), 2)
+        self.assertEqual(paginator.count, 5)
+        paginator = EstimatedCountPaginator(Product.objects.filter(inventory__gte=3).order_by('id'), 2)
+        paginator.exact_count_limit = 1
+        self.assertEqual(paginator.count, 2)
+
+    def test_estimate_count(self):
+        # SQLite keeps no cheap statistics, the count is exact
+        self.assertEqual(estimate_count(Product.objects.all()), 5)
+
+    def test_changelists(self):
+        self.client.force_login(self.admin)
+        Comment.objects.create(product=Product.objects.first(), name='n', body='b')
+        for model in ('product', 'comment', 'order', 'cart', 'outboxevent'):
+            self.assertEqual(self.client.get(f'/admin/store/{model}/').status_code, 200, model)
+
+
+class PricingTests(StoreTestCase):
+    def test_api_prices_match_the_python_functions(self):
+        product = self.create_product(unit_price='19.99')
+        discount = Discount.objects.create(discount=12.5, description='sale')
+        product.discounts.add(discount, Discount.objects.create(discount=5, description='small'))
+
+        data = self.client.get(f'/store/products/{product.pk}/').json()
+        self.assertEqual(Decimal(str(data['discounted_price'])), pricing.discounted_price(Decimal('19.99'), Decimal('12.5')))
+        self.assertEqual(Decimal(str(data['unit_price_after_tax'])), pricing.price_after_tax(Decimal('19.99'), Decimal('12.5')))
+
+        discount.delete()
+        self.assertEqual(Product.objects.get(pk=product.pk).best_discount, 5)
+
+
+class TopProductTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.create_customer()
+        self.first = self.create_product(name='First', inventory=100)
+        self.second = self.create_product(name='Second', inventory=100)
+
+    def top_product_id(self):
+        return Category.objects.get(pk=self.category.pk).top_product_id
+
+    def test_best_seller_follows_orders(self):
+        self.order(self.customer, (self.first, 2))
+        self.assertEqual(self.top_product_id(), self.first.pk)
+        order = self.order(self.customer, (self.second, 3))
+        self.assertEqual(self.top_product_id(), self.second.pk)
+
+        order.status = Order.ORDER_STATUS_CANCELED
+        order.save()
+        self.assertEqual(self.top_product_id(), self.first.pk)
+
+    def test_top_endpoint(self):
+        self.order(self.customer, (self.first, 1), (self.second, 4))
+        response = self.client.get(f'/store/categories/{self.category.pk}/top/', {'limit': 1})
+        self.assertEqual([(row['title'], row['units_sold']) for row in response.json()], [('Second', 4)])
+        self.assertEqual(self.client.get('/store/categories/abc/top/').status_code, 404)
+        self.assertEqual(self.client.get('/store/categories/0/top/').status_code, 404)
+
+
+class SalesRollupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.create_customer()
+        self.product = self.create_product(inventory=100, unit_price=5)
+
+    def rollups(self):
+        return (list(ProductSalesDay.objects.values_list('orders_count', 'units', 'revenue')),
+                list(CategorySalesDay.objects.values_list('orders_count', 'units', 'revenue')))
+
+    def test_rollups_follow_orders_and_cancellations(self):
+        self.order(self.customer, (self.product, 2))
+        order = self.order(self.customer, (self.product, 3))
+        self.assertEqual(self.rollups(), ([(2, 5, Decimal('25'))], [(2, 5, Decimal('25'))]))
+
+        response = self.client.patch(f'/store/orders/{order.pk}/', {'status': Order.ORDER_STATUS_CANCELED})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rollups(), ([(1, 2, Decimal('10'))], [(1, 2, Decimal('10'))]))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).units_sold, 2)
+
+        ProductSalesDay.objects.all().delete()
+        call_command('rebuild_sales_rollups', stdout=StringIO())
+        self.assertEqual(self.rollups(), ([(1, 2, Decimal('10'))], [(1, 2, Decimal('10'))]))
+
+    def test_analytics_endpoint(self):
+        self.order(self.customer, (self.product, 2))
+        report = self.client.get('/store/analytics/').json()
+        self.assertEqual((report['units'], Decimal(str(report['revenue']))), (2, Decimal('10')))
+        self.assertEqual(self.client.get('/store/analytics/?start=2030-01-01&end=2020-01-01').status_code, 400)
+
+        self.client.force_authenticate(self.customer.user)
+        self.assertEqual(self.client.get('/store/analytics/').status_code, 403)
+
+
+class OutboxTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = self.order(self.create_customer(), (self.create_product(), 1))
+
+    def test_order_publishes_an_event(self):
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.topic, event.payload), ('order_created', {'order': self.order.pk}))
+
+    def test_claimed_events_are_leased(self):
+        self.assertEqual(len(outbox.claim(10)), 1)
+        self.assertEqual(outbox.claim(10), [])
+
+    def test_failures_are_retried_then_dead_lettered(self):
+        (event_id, _, _, attempts), = outbox.claim(10, max_attempts=2)
+        self.assertEqual(outbox.complete([], [(event_id, attempts, 'boom')], max_attempts=2), 0)
+        OutboxEvent.objects.update(available_at=timezone.now())
+
+        (event_id, _, _, attempts), = outbox.claim(10, max_attempts=2)
+        self.assertEqual(outbox.complete([], [(event_id, attempts, 'boom')], max_attempts=2), 1)
+        self.assertEqual(list(OutboxEvent.objects.dead().values_list('last_error', flat=True)), ['boom'])
+        self.assertEqual(outbox.claim(10, max_attempts=2), [])
+
+        outbox.retry(OutboxEvent.objects.all())
+        self.assertEqual(len(outbox.claim(10, max_attempts=2)), 1)
+
+    def test_expired_leases_out_of_attempts_are_dead_lettered(self):
+        outbox.claim(10, lease=0, max_attempts=1)
+        self.assertEqual(outbox.claim(10, max_attempts=1), [])
+        self.assertEqual(OutboxEvent.objects.dead().get().last_error, outbox.LEASE_EXPIRED)
+
+    def test_dispatch(self):
+        outbox.complete([OutboxEvent.objects.get().pk], [])
+        self.assertFalse(OutboxEvent.objects.pending().exists())
+
+
+@override_settings(STORE_STOCK={'LOW': 3, 'HIGH': 17, 'STREAM_TIMEOUT': 0, 'POLL_INTERVAL': 0})
+class StockAlertTests(StoreTestCase):
+    def levels(self, product):
+        return list(StockAlert.objects.filter(product=product).order_by('id').values_list('previous_level', 'level'))
+
+    def test_crossings_of_saves_and_orders(self):
+        product = self.create_product(inventory=20)
+        product.inventory = 10
+        product.save()
+        product.inventory = 12
+        product.save()
+        self.order(self.create_customer(), (product, 10))
+        self.assertEqual(self.levels(product), [(StockAlert.LEVEL_HIGH, StockAlert.LEVEL_MEDIUM),
+                                                (StockAlert.LEVEL_MEDIUM, StockAlert.LEVEL_LOW)])
+
+    def test_stock_level(self):
+        self.assertEqual([stock.stock_level(inventory) for inventory in (2, 3, 16, 17)],
+                         [StockAlert.LEVEL_LOW, StockAlert.LEVEL_MEDIUM, StockAlert.LEVEL_MEDIUM, StockAlert.LEVEL_HIGH])
+
+    def test_clear_inventory_records_the_crossings(self):
+        products = [self.create_product(inventory=inventory) for inventory in (0, 5, 20)]
+        self.client.force_login(self.admin)
+        self.client.post('/admin/store/product/', {
+            'action': 'clear_inventory', '_selected_action': [product.pk for product in products]})
+        # the products that were not Low already
+        self.assertEqual(StockAlert.objects.filter(level=StockAlert.LEVEL_LOW).count(), 2)
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    def test_stream(self):
+        product = self.create_product(inventory=20)
+        product.inventory = 0
+        product.save()
+        alert = StockAlert.objects.get()
+
+        response = self.client.get('/store/stock-alerts/', {'after': 0})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = async_to_sync(self.read)(response)
+        self.assertIn(f'id: {alert.pk}\nevent: stock\n', body)
+        self.assertEqual(self.client.get('/store/stock-alerts/', {'after': 'x'}).status_code, 400)
+        self.assertEqual(APIClient().get('/store/stock-alerts/').status_code, 401)
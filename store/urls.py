@@ -23,6 +23,10 @@ cart_item_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 cart_item_router.register(
     'items', views.CartItemViewSet, basename='cart-items')
 
-urlpatterns = router.urls + products_router.urls + cart_item_router.urls
+urlpatterns = router.urls + products_router.urls + cart_item_router.urls + [
+    path('analytics/', views.SalesAnalyticsView.as_view(), name='analytics'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('stock-alerts/', views.StockAlertStreamView.as_view(), name='stock-alerts'),
+]
 
 # mywebsite.com/products/553:product_pk/comments/8:pk  Nested Routing
@@ -1,45 +1,86 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db.models import Count, Prefetch
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import api_view
-from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.mixins import CreateModelMixin, ListModelMixin
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, GenericViewSet
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny, DjangoModelPermissions
 
-from .filters import ProductFilter
-from .signals import order_created
-from .models import Category, Order, Product, Comment, Cart, CartItem, Customer, OrderItem
-from .paginations import DefaultPagination
-from .serializers import ProductSerializer, CategorySerializer, CommentSerializer, CartSerializer, CartItemSerializer, \
-    AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, OredrItemSerializer, OrderForAdminSerializer, OrderCreateSerializer, OrderUpdateSerializer
-from .permissions import IsAdminOrReadOnly, SendPrivateEmail, CustomDjangoModelPermissions
-
-
-class ProductViewSet(ModelViewSet):
+from . import analytics, stock
+from .async_views import AsyncReadMixin
+from .bulk import export_products, import_products, read_csv, read_ndjson
+from . import metrics as store_metrics
+from .caching import CachedResponseMixin, ConditionalGetMixin
+from .compiled_serializers import CompiledReadMixin
+from .filters import ProductFilter, ProductSearchFilter
+from .models import Category, Discount, Order, Product, Comment, Cart, CartItem, Customer, OrderItem, \
+    cart_expiry_cutoff
+from .paginations import KeysetPagination
+from .serializers import ProductSerializer, TopProductSerializer, CategorySerializer, CommentSerializer, CartSerializer, CartItemSerializer, \
+    AddCartItemSerializer, BatchAddCartItemSerializer, UpdateCartItemSerializer, CartSummarySerializer, CustomerSerializer, OrderSerializer, OredrItemSerializer, OrderForAdminSerializer, OrderCreateSerializer, OrderSummarySerializer, OrderUpdateSerializer, \
+    SalesReportQuerySerializer, SalesReportSerializer, StockAlertSerializer
+from .permissions import IsAdminOrReadOnly, MetricsAccess, SendPrivateEmail, CustomDjangoModelPermissions
+
+
+class ProductViewSet(AsyncReadMixin, ConditionalGetMixin, CachedResponseMixin, CompiledReadMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    # category titles feed the search index, discounts feed prices
+    cache_models = [Product, Category, Discount]
 
-    filter_backends = [SearchFilter, DjangoFilterBackend, OrderingFilter]
+    filter_backends = [ProductSearchFilter, DjangoFilterBackend, OrderingFilter]
     # filterset_fields = ['category_id', 'category__title', 'inventory']
     filterset_class = ProductFilter
     ordering_fields = ['name', 'unit_price']
     search_fields = ['name']
 
-    pagination_class = DefaultPagination
+    pagination_class = KeysetPagination
     permission_classes = [CustomDjangoModelPermissions]
 
-    queryset = Product.objects.all()
+    # prices are computed in the query, see store.pricing
+    queryset = Product.objects.with_prices()
 
     def get_serializer_context(self):
         return {'request': self.request}
 
+    @action(detail=False, methods=['get', 'post'], permission_classes=[IsAdminUser])
+    def bulk(self, request):
+        try:
+            batch_size = min(max(int(request.query_params['batch_size']), 1), 10000)
+        except (KeyError, ValueError):
+            batch_size = 1000
+
+        if request.method == 'GET':
+            output = request.query_params.get('type', 'ndjson')
+            content_type = 'text/csv' if output == 'csv' else 'application/x-ndjson'
+            response = StreamingHttpResponse(export_products(output, chunk_size=batch_size), content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="products.{"csv" if output == "csv" else "ndjson"}"'
+            return response
+
+        # read the body as a stream, request.data would load all of it
+        if request.stream is None:
+            return Response({'error': 'Empty request body'}, status=status.HTTP_400_BAD_REQUEST)
+        if request.content_type.startswith('text/csv'):
+            rows = read_csv(request.stream)
+        elif request.content_type.startswith(('application/x-ndjson', 'application/jsonl')):
+            rows = read_ndjson(request.stream)
+        else:
+            return Response({'error': 'Send text/csv or application/x-ndjson'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        return Response(import_products(rows, batch_size=batch_size))
+
     def destroy(self, request, pk):
         product = get_object_or_404(
             Product.objects.select_related('category'), pk=pk)
@@ -53,48 +94,90 @@ class ProductViewSet(ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(AsyncReadMixin, CachedResponseMixin, CompiledReadMixin, ModelViewSet):
     serializer_class = CategorySerializer
-    queryset = Category.objects.filter().prefetch_related('products').all()
+    async_actions = ('list',)
+    # product saves move the category counters
+    cache_models = [Category, Product]
+    queryset = Category.objects.all()
     permission_classes = [IsAdminOrReadOnly]
 
     def destroy(self, request, pk):
-        category = get_object_or_404(
-            Category.objects.prefetch_related('products'), pk=pk)
-        if category.products.count() > 0:
+        category = get_object_or_404(Category, pk=pk)
+        if category.products.exists():
             return Response({'error': 'There is some products relating  this category. please remove the first'},
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
         category.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=True)
+    def top(self, request, pk):
+        try:
+            limit = min(max(int(request.query_params['limit']), 1), 100)
+        except (KeyError, ValueError):
+            limit = 10
+
+        try:
+            get_object_or_404(Category, pk=pk)
+        except (TypeError, ValueError, DjangoValidationError):
+            # malformed pk, as the compiled retrieve answers it
+            raise Http404
+        # seeked on the (category, units_sold, id) index
+        products = Product.objects.with_prices().filter(category_id=pk).best_sellers()[:limit]
+        return Response(TopProductSerializer(products, many=True).data)
+
 
 class CommentViewSet(ModelViewSet):
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
+    # seeked on by the paginator, served by the (product, status, datetime_created) index
+    ordering_fields = ['datetime_created']
 
     def get_queryset(self):
         product_pk = self.kwargs['product_pk']
 
-        return Comment.objects.filter(product_id=product_pk).all()
+        # approved comments only, staff can moderate the others with ?status=
+        status = Comment.COMMENT_STATUS_APPROVED
+        if self.request.user.is_staff:
+            status = self.request.query_params.get('status', status)
+
+        return Comment.objects.filter(product_id=product_pk, status=status).order_by('-datetime_created')
 
     def get_serializer_context(self):
         return {'product_pk': self.kwargs['product_pk']}
 
 
-class CartViewSet(CreateModelMixin,
+class CartViewSet(AsyncReadMixin,
+                  CompiledReadMixin,
+                  CreateModelMixin,
                   RetrieveModelMixin,
                   DestroyModelMixin,
                   GenericViewSet):
     serializer_class = CartSerializer
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    async_actions = ('retrieve',)
+    queryset = Cart.objects.with_totals().prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product').with_totals())).all()
     lookup_value_regex = '[0-9a-fA-F]{8}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{4}\-?[0-9a-fA-F]{12}'
 
+    def get_queryset(self):
+        # an expired cart is gone for the client even before purge_carts deletes it
+        return super().get_queryset().active()
+
+    @action(detail=True)
+    def summary(self, request, pk):
+        cart = get_object_or_404(
+            Cart.objects.active().with_totals().values('id', 'items_count', 'quantity_total', 'unit_price_total'),
+            pk=pk)
+        return Response(CartSummarySerializer(cart).data)
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
 
     def get_queryset(self):
         cart_pk = self.kwargs['cart_pk']
-        return CartItem.objects.select_related('product').filter(cart_id=cart_pk).all()
+        return (CartItem.objects.select_related('product')
+                .filter(cart_id=cart_pk, cart__created_at__gte=cart_expiry_cutoff()).with_totals())
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -106,6 +189,13 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_pk': self.kwargs['cart_pk']}
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request, cart_pk):
+        serializer = BatchAddCartItemSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        return Response(AddCartItemSerializer(cart_items, many=True).data, status=status.HTTP_201_CREATED)
+
 
 class CustomerViewSet(ModelViewSet):
     serializer_class = CustomerSerializer
@@ -115,8 +205,8 @@ class CustomerViewSet(ModelViewSet):
     @action(detail=False, methods=['get', 'put'], permission_classes=[IsAuthenticated])
     def me(self, request):
 
-        user_id = request.user.id
-        customer = Customer.objects.get(user_id=user_id)
+        # resolved along with the user by core.authentication.CachedJWTAuthentication
+        customer = request.user.customer
 
         if request.method == 'GET':
             serializer = CustomerSerializer(customer)
@@ -133,31 +223,27 @@ class CustomerViewSet(ModelViewSet):
         return Response(f'sending email for customer {pk}')
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(CompiledReadMixin, ModelViewSet):
     # serializer_class = OrderSerializer
 
     # permission_classes = [IsAuthenticated]
 
     http_method_names = ['get', 'post', 'patch', 'delete', 'options', 'head']
 
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status']
+    pagination_class = KeysetPagination
+    # seeked on by the paginator, served by the (customer, datetime_created, id) index
+    ordering_fields = ['datetime_created']
+
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
-        queryset = Order.objects.prefetch_related(
-
-            Prefetch(
-
-                'items',
-                queryset=OrderItem.objects.select_related(
-                    'product'),
-
-
-            )
-
-        ).select_related('customer__user').all()
+        # no prefetch, the compiled read path loads the items of the current page only
+        queryset = Order.objects.order_by('-datetime_created')
 
         user = self.request.user
 
@@ -165,6 +251,10 @@ class OrderViewSet(ModelViewSet):
             return queryset
         return queryset.filter(customer__user_id=user.id)
 
+    @action(detail=False)
+    def summary(self, request):
+        return Response(OrderSummarySerializer(self.get_queryset().summary()).data)
+
     def get_serializer_class(self):
 
         if self.request.method == 'POST':
@@ -182,11 +272,66 @@ class OrderViewSet(ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         create_order_serializer = OrderCreateSerializer(
-            data=request.data, context={'user_id': self.request.user.id})
+            data=request.data, context={'customer_id': self.request.user.customer.id})
         create_order_serializer.is_valid(raise_exception=True)
+        # order_created is delivered from the outbox, see store.outbox
         create_order = create_order_serializer.save()
 
-        order_created.send_robust(self.__class__, order=create_order)
-
+        create_order = Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))).get(pk=create_order.pk)
         serializer = OrderSerializer(create_order)
         return Response(serializer.data)
+
+
+class SalesAnalyticsView(APIView):
+    """Sales of a date range from the daily rollups, see store.analytics."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(SalesReportSerializer(analytics.sales_report(**query.validated_data)).data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # errors only, the events are streamed by the view
+        return f'event: error\ndata: {JSONRenderer().render(data).decode()}\n\n'.encode()
+
+
+class StockAlertStreamView(APIView):
+    """
+    Server-Sent Events of the stock level crossings, see store.stock.
+
+    Starts after `Last-Event-ID` (sent by reconnecting clients) or `?after=`,
+    with the alerts written from then on by default. The events come from an
+    async generator, to be served by config.asgi: a WSGI server buffers the
+    whole stream.
+    """
+    permission_classes = [IsAdminUser]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request):
+        after = request.headers.get('Last-Event-ID') or request.query_params.get('after')
+        try:
+            after = int(after) if after is not None else stock.latest_alert_id()
+        except ValueError:
+            raise ValidationError({'after': 'A valid integer is required.'})
+
+        response = StreamingHttpResponse(
+            stock.alert_events(after, StockAlertSerializer), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # no buffering by nginx, the events must reach the client as they are written
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MetricsView(APIView):
+    """The request metrics of this process in the Prometheus text format, see store.metrics."""
+    permission_classes = [MetricsAccess]
+
+    def get(self, request):
+        return HttpResponse(store_metrics.render_prometheus(), content_type='text/plain; version=0.0.4')